@@ -0,0 +1,223 @@
+"""
+Optional asyncio runtime of the bot. Start it with "python async_bot.py" instead of "python bot.py".
+
+Command handlers, the reminder notifier and the daily checks run as tasks on a single event loop.
+Blocking gspread and weather calls are moved to worker threads with asyncio.to_thread, so a slow
+Google Sheets request delays only the command that made it instead of every command behind it.
+Replies and reminders are delivered by the same outbound queue (send_queue.py) as in bot.py.
+"""
+
+import asyncio
+import datetime
+import logging
+import threading
+from functools import wraps
+
+from telebot.async_telebot import AsyncTeleBot
+
+from bot import (
+    TOKEN, WEBHOOK_URL, DAILY_CHECKS_TIME, EVENTS_REFRESH_INTERVAL, NOTIFIER_RETRY_DELAY, SYNC_WORKERS, help_message, app, health_threads, tenants,
+    outbound_queue, send_message, reply_to, edit_message, send_reminder,
+    command_latency, notifier_loop_latency, notifier_failures, sync_latency,
+    LIST_CALLBACK_PREFIX, list_response, list_callback_response, event_response, check_birthdays, due_reminders, sync_tenant,
+    weather_response, daily_forecasts, birthdays_response, connect_tenants,
+)
+
+logger = logging.getLogger(__name__)
+
+async_bot = AsyncTeleBot(TOKEN)
+
+# Set by /event so the notifier picks up new events and the sync pushes them without waiting for the refresh interval
+notifier_wakeup = asyncio.Event()
+sync_wakeup = asyncio.Event()
+
+
+class TaskLiveness:
+    """
+    Wraps asyncio.Task with the is_alive()/name interface that check_thread_liveness expects
+    """
+    def __init__(self, task):
+        self.task = task
+        self.name = task.get_name()
+
+    def is_alive(self):
+        return not self.task.done()
+
+
+def restrict_chat_access(func):
+    """
+    Allows access only for users from groups registered in tenants
+    """
+    @wraps(func)
+    async def wrapper(message):
+        if message.chat.id in tenants:
+            with command_latency.time(handler=func.__name__):
+                return await func(message)
+    return wrapper
+
+@async_bot.message_handler(commands=['start'])
+@restrict_chat_access
+async def start(message):
+    user = message.from_user
+    logger.info(f"Received /start command from user: {user.username}")
+    reply_to(message, f"Hi {user.first_name}!")
+
+@async_bot.message_handler(func=lambda message: message.new_chat_members is not None)
+@restrict_chat_access
+async def handle_new_chat_members(message):
+    for member in message.new_chat_members:
+        welcome_message = f"Welcome, {member.username}! Feel free to explore and use the available commands."
+        send_message(message.chat.id, welcome_message)
+        send_message(message.chat.id, help_message)
+
+@async_bot.message_handler(commands=['help'])
+@restrict_chat_access
+async def help_command(message):
+    logger.info(f"Received /help command from user: {message.from_user.username}")
+    reply_to(message, help_message)
+
+@async_bot.message_handler(commands=['list'])
+@restrict_chat_access
+async def handle_list_command(message):
+    logger.info(f"Received /list command from user: {message.from_user.username}")
+    response, keyboard = await asyncio.to_thread(list_response, tenants.get(message.chat.id), message.text)
+    reply_to(message, response, reply_markup=keyboard)
+
+@async_bot.callback_query_handler(func=lambda call: call.data.startswith(LIST_CALLBACK_PREFIX))
+async def handle_list_page(call):
+    chat_id = call.message.chat.id
+    if chat_id not in tenants:
+        return
+    response, keyboard = await asyncio.to_thread(list_callback_response, tenants.get(chat_id), call.data)
+    edit_message(chat_id, call.message.message_id, response, reply_markup=keyboard)
+    await async_bot.answer_callback_query(call.id)
+
+@async_bot.message_handler(commands=['event'])
+@restrict_chat_access
+async def handle_event_command(message):
+    logger.info(f"Received /event command from user: {message.from_user.username}")
+    command_text = message.text.split("/event", 1)[-1].strip()
+    response = await asyncio.to_thread(event_response, tenants.get(message.chat.id), command_text)
+    notifier_wakeup.set()
+    sync_wakeup.set()
+    reply_to(message, response)
+
+@async_bot.message_handler(commands=['w'])
+@restrict_chat_access
+async def weather_check_command(message):
+    logger.info(f"Received /w command from user: {message.from_user.username}")
+    city = message.text.split(maxsplit=1)[1] if len(message.text.split(maxsplit=1)) > 1 else None
+    response = await asyncio.to_thread(weather_response, tenants.get(message.chat.id), city)
+    reply_to(message, response)
+
+@async_bot.message_handler(commands=['b'])
+@restrict_chat_access
+async def birthday_check_command(message):
+    logger.info(f"Received /b command from user: {message.from_user.username}")
+    response = await asyncio.to_thread(birthdays_response, tenants.get(message.chat.id), message.text)
+    reply_to(message, response)
+
+async def check_tenant_events(tenant):
+    """
+    Queues the due reminders of one tenant. Returns seconds until its next reminder (None if there is none).
+    """
+    try:
+        # Rebuilding the reminder queue of a big sheet takes seconds, it must not block command handlers
+        for reminder in await asyncio.to_thread(due_reminders, tenant):
+            send_reminder(tenant, reminder)
+    except Exception as e:
+        notifier_failures.inc(chat_id=tenant.chat_id)
+        logger.error(f"An error occurred in the check_events_and_notify function for chat {tenant.chat_id}: {str(e)}")
+        tenant.reminder_scheduler.invalidate()
+        return NOTIFIER_RETRY_DELAY
+    return tenant.reminder_scheduler.seconds_until_next()
+
+async def check_events_and_notify():
+    """
+    Asyncio version of bot.check_events_and_notify: checks all tenants concurrently, then sleeps until
+    the next reminder is due, events change or the refresh interval has passed
+    """
+    while True:
+        notifier_wakeup.clear()
+        with notifier_loop_latency.time(worker="0"):
+            delays = await asyncio.gather(*(check_tenant_events(tenant) for tenant in tenants))
+        delay = min([EVENTS_REFRESH_INTERVAL] + [delay for delay in delays if delay is not None])
+        try:
+            await asyncio.wait_for(notifier_wakeup.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+async def sync_with_google_sheets():
+    '''
+    Asyncio version of bot.sync_with_google_sheets, tenants are synced concurrently in worker threads
+    '''
+    semaphore = asyncio.Semaphore(SYNC_WORKERS)
+
+    async def sync(tenant):
+        async with semaphore:
+            alert = await asyncio.to_thread(sync_tenant, tenant)
+        if alert:
+            send_message(tenant.chat_id, alert)
+        if tenant.reminder_scheduler.version != tenant.event_store.version:
+            notifier_wakeup.set()
+
+    while True:
+        sync_wakeup.clear()
+        with sync_latency.time():
+            await asyncio.gather(*(sync(tenant) for tenant in tenants))
+        try:
+            await asyncio.wait_for(sync_wakeup.wait(), timeout=EVENTS_REFRESH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+def seconds_until(time_of_day, current_datetime=None):
+    """
+    Returns number of seconds until the next time_of_day ("HH:MM")
+    """
+    if current_datetime is None:
+        current_datetime = datetime.datetime.now()
+    hour, minute = map(int, time_of_day.split(":"))
+    next_run = current_datetime.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if next_run <= current_datetime:
+        next_run += datetime.timedelta(days=1)
+    return (next_run - current_datetime).total_seconds()
+
+async def daily_checks():
+    '''
+    Sends weather forecast and birthdays for today at DAILY_CHECKS_TIME. Both are fetched concurrently.
+    '''
+    while True:
+        await asyncio.sleep(seconds_until(DAILY_CHECKS_TIME))
+        try:
+            forecasts, *birthdays = await asyncio.gather(
+                asyncio.to_thread(daily_forecasts),
+                *(asyncio.to_thread(check_birthdays, tenant.birthday_index) for tenant in tenants),
+            )
+            for chat_id, forecast in forecasts.items():
+                send_message(chat_id, forecast)
+            logger.info("Weather forecast has been sent.")
+            for tenant, tenant_birthdays in zip(tenants, birthdays):
+                send_message(tenant.chat_id, tenant_birthdays)
+            logger.info("Birthday notifications with ages have been sent.")
+        except Exception as e:
+            logger.error(f"An error occurred in the daily_checks function: {str(e)}")
+
+async def main():
+    if WEBHOOK_URL:
+        logger.warning("Webhook mode is supported by bot.py only, the asyncio runtime uses long polling.")
+    await async_bot.delete_webhook()
+    tasks = [
+        asyncio.create_task(check_events_and_notify(), name="Check events task"),
+        asyncio.create_task(sync_with_google_sheets(), name="Google Sheets sync task"),
+        asyncio.create_task(daily_checks(), name="Weather and birthdays check task"),
+        asyncio.create_task(async_bot.infinity_polling(), name="Telegram Bot task"),
+    ]
+    health_threads.extend(TaskLiveness(task) for task in tasks)
+    health_threads.append(outbound_queue.start())
+    await asyncio.gather(*tasks)
+
+if __name__ == "__main__":
+    # Flask is a WSGI app, it keeps serving /health from its own thread
+    connect_tenants()
+    threading.Thread(target=app.run, name="Flask thread", daemon=True).start()
+    asyncio.run(main())
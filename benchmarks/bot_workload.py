@@ -0,0 +1,227 @@
+"""
+Offline benchmark of the whole bot against the in-memory fakes of benchmarks/fakes.py.
+
+For every --rows size a synthetic spreadsheet with that many events and birthdays is served to bot.py
+through bot.use_backends(), with simulated Google Sheets, Telegram and Open-Meteo latency. The run
+- syncs the chat with the sheet (sync_tenant),
+- runs check_events_and_notify until --reminders reminders, due at the same minute, reached Telegram,
+- replays --commands /list (with Next pages), /event, /b (check_birthdays) and /w commands,
+and reports throughput, how late reminders reached Telegram after their deadline and the API calls made.
+Sheets keep times to the minute, so the reminders fall due at the first whole minute at least
+LEAD_TIME seconds after the sheet is made: every size takes up to a minute and a half.
+Every size runs in a fresh process, because bot.py keeps its tenants and threads in module globals.
+
+Run from the repository root:
+    python -m benchmarks.bot_workload --rows 10 1000 100000
+    python -m benchmarks.bot_workload --rows 100000 --sheets-latency 0.5 --commands 50
+"""
+
+import argparse
+import datetime
+import logging
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.fakes import ApiCalls, FakeGspreadClient, FakeOpenMeteo, FakeSheetsClient, FakeTelegram
+
+CHAT_ID = -1001234567890
+SPREADSHEET_ID = "benchmark"
+DATE_FORMAT = "%d.%m.%Y"
+TIME_FORMAT = "%H:%M"
+# Reminder offset the due reminders are sent for, the earlier ones are marked as sent in the sheet
+DUE_OFFSET = datetime.timedelta(hours=1)
+# Time left for the first sync before the reminders fall due
+LEAD_TIME = datetime.timedelta(seconds=30)
+# Next pages followed by every other /list command
+LIST_PAGES = 5
+
+
+def make_event_rows(rows, reminders, current_datetime, seed):
+    """
+    Returns sheet rows and {event name: reminder deadline} of the reminders that fall due during the run.
+    The other events are spread over the next year and need no reminders during the run.
+    """
+    rng = random.Random(seed)
+    sheet_rows = [["Name", "Date", "Time", "Notification_status", "Repeat", "Reminders"]]
+    deadlines = {}
+    deadline = (current_datetime + LEAD_TIME).replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+    for index in range(rows):
+        name = f"Event_{index:06d}"
+        status = ""
+        if index < reminders:
+            event_datetime = deadline + DUE_OFFSET
+            deadlines[name] = deadline
+            status = "Notified: 24h, 4h"
+        else:
+            event_datetime = current_datetime + datetime.timedelta(days=2 + rng.randrange(365), minutes=rng.randrange(0, 1440, 15))
+        sheet_rows.append([name, event_datetime.strftime(DATE_FORMAT), event_datetime.strftime(TIME_FORMAT), status, "", ""])
+    return sheet_rows, deadlines
+
+
+def make_birthday_rows(rows, seed):
+    rng = random.Random(seed)
+    sheet_rows = [["Person", "Date"]]
+    for index in range(rows):
+        birth_date = datetime.date(1950, 1, 1) + datetime.timedelta(days=rng.randrange(365 * 60))
+        sheet_rows.append([f"Person_{index:06d}", birth_date.strftime(DATE_FORMAT)])
+    return sheet_rows
+
+
+def timed(function, count):
+    """
+    Calls function(index) count times, returns the durations in seconds
+    """
+    durations = []
+    for index in range(count):
+        started = time.perf_counter()
+        function(index)
+        durations.append(time.perf_counter() - started)
+    return durations
+
+
+def summary(durations):
+    values = sorted(durations)
+    total = sum(values)
+    return {
+        "count": len(values),
+        "per_second": len(values) / total if total else float("inf"),
+        "mean": statistics.mean(values),
+        "p95": values[min(len(values) - 1, int(len(values) * 0.95))],
+        "max": values[-1],
+    }
+
+
+def reminder_lateness(telegram, deadlines):
+    """
+    Returns seconds between the deadline of every delivered reminder and its arrival in Telegram
+    """
+    lateness = []
+    for received, _, text in list(telegram.messages):
+        for line in text.splitlines():
+            name = line.rsplit(" until ", 1)[-1] if line.startswith("Reminder: ") else None
+            if name in deadlines:
+                lateness.append((received - deadlines.pop(name)).total_seconds())
+    return lateness
+
+
+def run(rows, args):
+    # Read by bot.py at import: no database file is left behind and one notifier serves the chat
+    os.environ.pop("TENANTS_CONFIG", None)
+    os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    os.environ["NOTIFIER_WORKERS"] = "1"
+
+    import bot
+    from local_store import LocalDatabase
+    from tenants import Tenant, TenantRegistry
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    calls = ApiCalls()
+    gspread_client = FakeGspreadClient(calls, latency=args.sheets_latency)
+    spreadsheet = gspread_client.add_spreadsheet(SPREADSHEET_ID)
+    current_datetime = datetime.datetime.now()
+    event_rows, deadlines = make_event_rows(rows, args.reminders, current_datetime, args.seed)
+    spreadsheet.add_worksheet("Schedule", event_rows)
+    spreadsheet.add_worksheet("Birthdays", make_birthday_rows(rows, args.seed))
+    telegram = FakeTelegram(calls, latency=args.telegram_latency)
+    bot.use_backends(sheets=FakeSheetsClient(gspread_client), telegram=telegram,
+                     weather=FakeOpenMeteo(calls, latency=args.open_meteo_latency))
+    bot.connect_tenants(TenantRegistry([Tenant(CHAT_ID, SPREADSHEET_ID, "Schedule")]),
+                        local_database=LocalDatabase(os.environ["DATABASE_PATH"]))
+    tenant = bot.tenants.get(CHAT_ID)
+    bot.outbound_queue.start()
+
+    results = {"rows": rows, "operations": {}, "calls": {}}
+
+    def phase(name, function, count=1):
+        before = calls.snapshot()
+        results["operations"][name] = summary(timed(function, count))
+        results["calls"][name] = dict(calls.since(before))
+
+    phase("sync", lambda _: bot.sync_tenant(tenant))
+
+    # Reminders: the notifier runs on its own, like in production, until every due reminder reached Telegram
+    before = calls.snapshot()
+    expected = len(deadlines)
+    threading.Thread(target=bot.check_events_and_notify, name="Check events thread 0", daemon=True).start()
+    lateness = []
+    give_up = max(deadlines.values(), default=current_datetime) + datetime.timedelta(seconds=args.timeout)
+    while deadlines and datetime.datetime.now() < give_up:
+        time.sleep(0.1)
+        lateness += reminder_lateness(telegram, deadlines)
+    lateness += reminder_lateness(telegram, deadlines)
+    results["reminders"] = {"expected": expected, "delivered": len(lateness), "lateness": lateness}
+    results["calls"]["reminders"] = dict(calls.since(before))
+
+    def list_command(index):
+        response, keyboard = bot.list_response(tenant, "/list" if index % 2 else "/list week")
+        # Every other command pages through the list with the Next button
+        for _ in range(LIST_PAGES if index % 2 else 0):
+            buttons = [] if keyboard is None else [
+                button for button in keyboard.keyboard[-1] if button.callback_data.split()[2] == "next"
+            ]
+            if not buttons:
+                break
+            response, keyboard = bot.list_callback_response(tenant, buttons[0].callback_data)
+
+    event_datetime = current_datetime + datetime.timedelta(days=30)
+    phase("/list", list_command, args.commands)
+    phase("/event", lambda index: bot.event_response(
+        tenant, f"Added_{index} {event_datetime.strftime(DATE_FORMAT)} {event_datetime.strftime(TIME_FORMAT)}"
+    ), args.commands)
+    phase("/b", lambda _: bot.check_birthdays(tenant.birthday_index), args.commands)
+    phase("/w", lambda _: bot.weather_response(tenant), args.commands)
+    # New events and reminder statuses are written back with a few batched requests
+    phase("sync after commands", lambda _: bot.sync_tenant(tenant))
+    results["telegram_messages"] = len(telegram.messages)
+    results["telegram_failed"] = bot.outbound_queue.failed
+    return results
+
+
+def format_calls(calls):
+    if not calls:
+        return "-"
+    return ", ".join(f"{api}.{method}: {count}" for (api, method), count in sorted(calls.items()))
+
+
+def report(results):
+    print(f"\n=== {results['rows']} rows ===")
+    print(f"{'operation':<20} {'n':>5} {'ops/s':>10} {'mean ms':>10} {'p95 ms':>10} {'max ms':>10}  API calls")
+    for name, operation in results["operations"].items():
+        print(f"{name:<20} {operation['count']:>5} {operation['per_second']:>10.1f} {operation['mean'] * 1000:>10.2f} "
+              f"{operation['p95'] * 1000:>10.2f} {operation['max'] * 1000:>10.2f}  {format_calls(results['calls'][name])}")
+    reminders = results["reminders"]
+    lateness = sorted(reminders["lateness"])
+    line = f"reminders: {reminders['delivered']}/{reminders['expected']} delivered"
+    if lateness:
+        p95 = lateness[min(len(lateness) - 1, int(len(lateness) * 0.95))]
+        line += (f", lateness mean {statistics.mean(lateness):.2f} s, p95 {p95:.2f} s, max {lateness[-1]:.2f} s")
+    print(line + f"  API calls: {format_calls(results['calls']['reminders'])}")
+    print(f"Telegram messages: {results['telegram_messages']} sent, {results['telegram_failed']} failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 1000, 100000], help="events and birthdays in the sheets")
+    parser.add_argument("--reminders", type=int, default=100, help="reminders falling due at the same minute")
+    parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for reminders after their deadline")
+    parser.add_argument("--commands", type=int, default=100, help="commands of every kind")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="seconds per Google Sheets call")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="seconds per Telegram call")
+    parser.add_argument("--open-meteo-latency", type=float, default=0.1, help="seconds per Open-Meteo call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            report(executor.submit(run, rows, args).result())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Command latency under concurrent load: threaded TeleBot runtime (bot.py) vs asyncio runtime (async_bot.py).
+
+A burst of commands is handled by the response functions the handlers of both runtimes call
+(list_response, event_response, birthdays_response, weather_response) against the in-memory fakes
+of benchmarks/fakes.py, set up through bot.use_backends() with a synthetic sheet of --rows events.
+/w CITY looks the city up with the Open-Meteo fake, which blocks for --open-meteo-latency seconds.
+The threaded model runs the handlers in a pool of --workers threads like TeleBot's worker pool,
+the asyncio model runs them as tasks that move the blocking call to the event loop's default
+executor like async_bot.py does; the executor gets the same number of threads.
+Latency is measured from the arrival of the burst to the end of the handler, sending the reply excluded.
+
+Run from the repository root:
+    python -m benchmarks.command_latency --commands 40 --workers 2 --open-meteo-latency 0.3
+"""
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bot_workload import CHAT_ID, DATE_FORMAT, SPREADSHEET_ID, TIME_FORMAT, make_birthday_rows, make_event_rows
+from benchmarks.fakes import ApiCalls, FakeGspreadClient, FakeOpenMeteo, FakeSheetsClient, FakeTelegram
+
+COMMANDS = ("/help", "/list", "/event", "/b", "/w")
+
+
+def set_up(args):
+    """
+    Connects bot.py to the fakes and syncs the synthetic sheet. Returns the tenant.
+    """
+    os.environ.pop("TENANTS_CONFIG", None)
+    os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+
+    import bot
+    from local_store import LocalDatabase
+    from tenants import Tenant, TenantRegistry
+
+    logging.getLogger().setLevel(logging.WARNING)
+    calls = ApiCalls()
+    gspread_client = FakeGspreadClient(calls, latency=args.sheets_latency)
+    spreadsheet = gspread_client.add_spreadsheet(SPREADSHEET_ID)
+    spreadsheet.add_worksheet("Schedule", make_event_rows(args.rows, 0, datetime.datetime.now(), args.seed)[0])
+    spreadsheet.add_worksheet("Birthdays", make_birthday_rows(args.rows, args.seed))
+    bot.use_backends(sheets=FakeSheetsClient(gspread_client), telegram=FakeTelegram(calls),
+                     weather=FakeOpenMeteo(calls, latency=args.open_meteo_latency))
+    bot.connect_tenants(TenantRegistry([Tenant(CHAT_ID, SPREADSHEET_ID, "Schedule")]),
+                        local_database=LocalDatabase(os.environ["DATABASE_PATH"]))
+    tenant = bot.tenants.get(CHAT_ID)
+    bot.sync_tenant(tenant)
+    return tenant
+
+
+def make_workload(commands, seed):
+    rng = random.Random(seed)
+    return [rng.choice(COMMANDS) for _ in range(commands)]
+
+
+def make_handlers(tenant):
+    """
+    Returns {command: blocking part of its handler}, None for commands answered without one
+    """
+    import bot
+
+    event_datetime = datetime.datetime.now() + datetime.timedelta(days=30)
+    event_text = f"Benchmark {event_datetime.strftime(DATE_FORMAT)} {event_datetime.strftime(TIME_FORMAT)}"
+    cities = itertools.count()
+    return {
+        "/help": None,
+        "/list": lambda: bot.list_response(tenant, "/list"),
+        "/event": lambda: bot.event_response(tenant, event_text),
+        "/b": lambda: bot.birthdays_response(tenant, "/b 7"),
+        # Every city is new, so it is looked up with Open-Meteo geocoding
+        "/w": lambda: bot.weather_response(tenant, f"City_{next(cities)}"),
+    }
+
+
+def run_threaded(workload, handlers, workers):
+    latencies = []
+    started = time.perf_counter()
+
+    def worker(command):
+        if handlers[command] is not None:
+            handlers[command]()
+        latencies.append((command, time.perf_counter() - started))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for command in workload:
+            pool.submit(worker, command)
+    return latencies
+
+
+async def run_async(workload, handlers, workers):
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+    latencies = []
+    started = time.perf_counter()
+
+    async def task(command):
+        if handlers[command] is not None:
+            await asyncio.to_thread(handlers[command])
+        latencies.append((command, time.perf_counter() - started))
+
+    await asyncio.gather(*(task(command) for command in workload))
+    return latencies
+
+
+def report(name, latencies):
+    for command in COMMANDS:
+        values = sorted(latency for kind, latency in latencies if kind == command)
+        if not values:
+            continue
+        p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+        print(f"{name:<10} {command:<6} n={len(values):<4} "
+              f"mean={statistics.mean(values) * 1000:8.1f} ms  p95={p95 * 1000:8.1f} ms  max={values[-1] * 1000:8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--commands", type=int, default=40, help="number of commands arriving at once")
+    parser.add_argument("--workers", type=int, default=2, help="handler threads of both runtimes (TeleBot's default is 2)")
+    parser.add_argument("--rows", type=int, default=1000, help="events and birthdays in the sheets")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="seconds per Google Sheets call")
+    parser.add_argument("--open-meteo-latency", type=float, default=0.3, help="seconds per Open-Meteo call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    handlers = make_handlers(set_up(args))
+    workload = make_workload(args.commands, args.seed)
+    report("threaded", run_threaded(workload, handlers, args.workers))
+    report("asyncio", asyncio.run(run_async(workload, handlers, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
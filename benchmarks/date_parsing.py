@@ -0,0 +1,58 @@
+"""
+Micro-benchmark of date_time.parse_datetimes against the per-row convert_to_datetime.
+
+The synthetic column looks like a real schedule: dates spread over one year and times on
+a 15 minute grid, so many values repeat and the bulk parser's memoization applies.
+
+Run from the repository root:
+    python -m benchmarks.date_parsing --rows 100000
+"""
+
+import argparse
+import datetime
+import random
+import time
+
+from date_time import _parse_date, _parse_time, convert_to_datetime, parse_datetimes
+
+
+def make_columns(rows, seed):
+    rng = random.Random(seed)
+    start = datetime.date.today()
+    dates = [(start + datetime.timedelta(days=rng.randrange(365))).strftime("%d.%m.%Y") for _ in range(rows)]
+    times = [f"{rng.randrange(24):02d}:{rng.randrange(0, 60, 15):02d}" for _ in range(rows)]
+    return dates, times
+
+
+def best_of(repeat, function):
+    timings = []
+    for _ in range(repeat):
+        _parse_date.cache_clear()
+        _parse_time.cache_clear()
+        started = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    dates, times = make_columns(args.rows, args.seed)
+    per_row, expected = best_of(args.repeat, lambda: [convert_to_datetime(d, t) for d, t in zip(dates, times)])
+    bulk, result = best_of(args.repeat, lambda: parse_datetimes(dates, times))
+    bulk_epoch, _ = best_of(args.repeat, lambda: parse_datetimes(dates, times, epoch=True))
+    assert result == expected
+
+    print(f"rows: {args.rows}")
+    print(f"convert_to_datetime per row: {per_row * 1000:9.1f} ms")
+    print(f"parse_datetimes:             {bulk * 1000:9.1f} ms  ({per_row / bulk:.1f}x)")
+    print(f"parse_datetimes(epoch=True): {bulk_epoch * 1000:9.1f} ms  ({per_row / bulk_epoch:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+In-memory stand-ins for Google Sheets, the Telegram Bot API and Open-Meteo, used by the benchmarks.
+
+Every fake sleeps for its simulated latency on each call and counts the call in an ApiCalls
+counter, so a benchmark can report how many requests a workload would send. They are passed
+to bot.use_backends() in place of the real clients:
+
+    calls = ApiCalls()
+    sheets = FakeSheetsClient(FakeGspreadClient(calls, latency=0.2))
+    bot.use_backends(sheets=sheets, telegram=FakeTelegram(calls), weather=FakeOpenMeteo(calls))
+"""
+
+import collections
+import datetime
+import itertools
+import re
+import threading
+import time
+import types
+
+from telebot.apihelper import ApiTelegramException
+
+from send_queue import MAX_MESSAGE_LENGTH
+from sheets_client import GoogleSheetsClient
+from weather_check import GEOCODING_URL
+
+CELL_PATTERN = re.compile(r"^([A-Z]+)(\d+)$")
+
+
+class ApiCalls:
+    """
+    Thread-safe counter of API calls by (api, method)
+    """
+
+    def __init__(self):
+        self._counts = collections.Counter()
+        self._lock = threading.Lock()
+
+    def record(self, api, method):
+        with self._lock:
+            self._counts[(api, method)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return collections.Counter(self._counts)
+
+    def since(self, snapshot):
+        """
+        Returns the calls made after snapshot() returned snapshot
+        """
+        return self.snapshot() - snapshot
+
+
+class FakeApi:
+    api = "fake"
+
+    def __init__(self, calls, latency=0.0):
+        self.calls = calls
+        self.latency = latency
+
+    def _call(self, method):
+        self.calls.record(self.api, method)
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeResponse:
+    """
+    The part of requests.Response used by the bot
+    """
+
+    def __init__(self, data, status_code=200):
+        self._data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord("A") + 1
+    return number
+
+
+class FakeWorksheet(FakeApi):
+    """
+    A gspread.Worksheet kept in a list of rows. Every write changes the revision of its spreadsheet.
+    """
+    api = "sheets"
+
+    def __init__(self, spreadsheet, title, rows=None):
+        super().__init__(spreadsheet.calls, spreadsheet.latency)
+        self.spreadsheet = spreadsheet
+        self.title = title
+        self.rows = [list(row) for row in rows or []]
+        self._lock = threading.Lock()
+
+    def get_all_values(self):
+        self._call("get_all_values")
+        with self._lock:
+            return [list(row) for row in self.rows]
+
+    def append_rows(self, values, value_input_option=None, table_range=None):
+        self._call("append_rows")
+        with self._lock:
+            first_row = len(self.rows) + 1
+            self.rows.extend(list(row) for row in values)
+            last_row = len(self.rows)
+        self.spreadsheet.changed()
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first_row}:F{last_row}", "updatedRows": len(values)}}
+
+    def batch_update(self, data, **kwargs):
+        self._call("batch_update")
+        with self._lock:
+            for update in data:
+                letters, row = CELL_PATTERN.match(update["range"]).groups()
+                self._set_cell(int(row), column_number(letters), update["values"][0][0])
+        self.spreadsheet.changed()
+
+    def update_cell(self, row, col, value):
+        self._call("update_cell")
+        with self._lock:
+            self._set_cell(row, col, value)
+        self.spreadsheet.changed()
+
+    def insert_row(self, values, index=1):
+        self._call("insert_row")
+        with self._lock:
+            self.rows.insert(index - 1, list(values))
+        self.spreadsheet.changed()
+
+    def _set_cell(self, row, col, value):
+        while len(self.rows) < row:
+            self.rows.append([])
+        cells = self.rows[row - 1]
+        cells.extend([""] * (col - len(cells)))
+        cells[col - 1] = str(value)
+
+
+class FakeSpreadsheet:
+    def __init__(self, client, spreadsheet_id):
+        self.client = client
+        self.id = spreadsheet_id
+        self.calls = client.calls
+        self.latency = client.latency
+        self.version = 1
+        self._worksheets = {}
+        self._lock = threading.Lock()
+
+    def add_worksheet(self, title, rows=None):
+        worksheet = FakeWorksheet(self, title, rows)
+        self._worksheets[title] = worksheet
+        return worksheet
+
+    def worksheet(self, title):
+        if title not in self._worksheets:
+            raise KeyError(f"Worksheet {title} not found")
+        return self._worksheets[title]
+
+    def changed(self):
+        with self._lock:
+            self.version += 1
+
+
+class FakeGspreadClient(FakeApi):
+    """
+    A gspread.Client with in-memory spreadsheets, it also answers the Drive revision requests of fetch_revision()
+    """
+    api = "sheets"
+
+    def __init__(self, calls, latency=0.0):
+        super().__init__(calls, latency)
+        self.spreadsheets = {}
+        self.session = types.SimpleNamespace(close=lambda: None)
+
+    def add_spreadsheet(self, spreadsheet_id):
+        spreadsheet = FakeSpreadsheet(self, spreadsheet_id)
+        self.spreadsheets[spreadsheet_id] = spreadsheet
+        return spreadsheet
+
+    def open_by_key(self, key):
+        self._call("open_by_key")
+        return self.spreadsheets[key]
+
+    def request(self, method, endpoint, params=None):
+        self._call("drive_revision")
+        spreadsheet = self.spreadsheets[endpoint.rsplit("/", 1)[-1]]
+        return FakeResponse({"version": str(spreadsheet.version)})
+
+
+class FakeSheetsClient(GoogleSheetsClient):
+    """
+    GoogleSheetsClient connected to a FakeGspreadClient, worksheet handles and their metrics work as usual
+    """
+
+    def __init__(self, gspread_client):
+        super().__init__(credentials_file=None)
+        self.gspread_client = gspread_client
+
+    def _connect(self):
+        self._client = self.gspread_client
+
+    def _refresh_token_if_needed(self):
+        pass
+
+
+class FakeTelegram(FakeApi):
+    """
+    The Bot API calls of telebot.TeleBot made by the bot. Sent and edited texts are kept
+    in messages as (datetime.datetime.now() when it was received, chat id, text). Texts longer
+    than MAX_MESSAGE_LENGTH are rejected with error code 400 like the Bot API does.
+    """
+    api = "telegram"
+
+    def __init__(self, calls, latency=0.0):
+        super().__init__(calls, latency)
+        self.messages = []
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._call("sendMessage")
+        self._check_length("sendMessage", text)
+        return self._received(chat_id, text, next(self._message_ids))
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self._call("editMessageText")
+        self._check_length("editMessageText", text)
+        return self._received(chat_id, text, message_id)
+
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self._call("answerCallbackQuery")
+        return True
+
+    @staticmethod
+    def _check_length(method, text):
+        if len(text) > MAX_MESSAGE_LENGTH:
+            raise ApiTelegramException(method, None, {"ok": False, "error_code": 400,
+                                                      "description": "Bad Request: message is too long"})
+
+    def _received(self, chat_id, text, message_id):
+        with self._lock:
+            self.messages.append((datetime.datetime.now(), chat_id, text))
+        return types.SimpleNamespace(message_id=message_id, chat=types.SimpleNamespace(id=chat_id), text=text)
+
+
+class FakeOpenMeteo(FakeApi):
+    """
+    requests.Session for the Open-Meteo forecast and geocoding endpoints, answers with a fixed forecast
+    """
+    api = "open_meteo"
+
+    def get(self, url, params=None, timeout=None):
+        if url == GEOCODING_URL:
+            self._call("geocoding")
+            return FakeResponse({"results": [{"name": params["name"], "latitude": 45.25, "longitude": 19.83}]})
+        self._call("forecast")
+        latitudes = str(params["latitude"]).split(",")
+        forecasts = [self.forecast() for _ in latitudes]
+        # A single location is returned as an object, several ones as a list
+        return FakeResponse(forecasts if len(forecasts) > 1 else forecasts[0])
+
+    @staticmethod
+    def forecast():
+        return {
+            "hourly": {"temperature_2m": [float(hour % 12) for hour in range(24)], "weather_code": [0] * 24},
+            "daily": {"wind_speed_10m_max": [12.5], "uv_index_clear_sky_max": [4.2]},
+        }
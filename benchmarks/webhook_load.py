@@ -0,0 +1,162 @@
+"""
+Load test of the webhook mode: replays updates against the webhook route of bot.py and measures handled updates per second.
+
+Updates are read from a JSON lines file (for example updates recorded from getUpdates) or generated
+as /help, /list, /event and /b commands. bot.py is connected to the in-memory fakes of benchmarks/fakes.py
+through bot.use_backends(), with a tenant and a synthetic sheet of --rows events for every chat of the updates,
+so the real handlers run with simulated Google Sheets and Telegram latency. The updates are POSTed by
+--concurrency clients through Flask's test client to bot.py's /telegram-webhook route, which passes them
+to its UpdateDispatcher. Rejected (503) updates are counted, not retried.
+
+Run from the repository root:
+    python -m benchmarks.webhook_load --updates-count 2000 --concurrency 16
+    python -m benchmarks.webhook_load --updates recorded_updates.jsonl --workers 8 --queue-size 50
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.bot_workload import CHAT_ID, DATE_FORMAT, TIME_FORMAT, make_birthday_rows, make_event_rows
+from benchmarks.fakes import ApiCalls, FakeGspreadClient, FakeOpenMeteo, FakeSheetsClient, FakeTelegram
+
+COMMANDS = ("/help", "/list", "/event", "/b")
+SECRET = "benchmark-secret"
+
+
+def make_updates(count):
+    event_datetime = datetime.datetime.now() + datetime.timedelta(days=30)
+    event_arguments = f" Webhook {event_datetime.strftime(DATE_FORMAT)} {event_datetime.strftime(TIME_FORMAT)}"
+    updates = []
+    for update_id in range(1, count + 1):
+        command = COMMANDS[update_id % len(COMMANDS)]
+        updates.append({
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": CHAT_ID, "type": "supergroup", "title": "Schedule"},
+                "from": {"id": 1, "is_bot": False, "first_name": "Load", "username": "load_test"},
+                "text": command + (event_arguments if command == "/event" else ""),
+                "entities": [{"type": "bot_command", "offset": 0, "length": len(command)}],
+            },
+        })
+    return updates
+
+
+def load_updates(path):
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def chat_ids(updates):
+    ids = set()
+    for update in updates:
+        for kind in ("message", "edited_message", "callback_query"):
+            message = update.get(kind)
+            if message is not None:
+                ids.add((message.get("message") or message)["chat"]["id"])
+    return ids
+
+
+def set_up(updates, args):
+    """
+    Connects bot.py to the fakes with a tenant for every chat of the updates. Returns (bot module, ApiCalls).
+    """
+    # Read by bot.py at import: webhook mode with a non-threaded TeleBot, like `python bot.py` with WEBHOOK_URL
+    os.environ.pop("TENANTS_CONFIG", None)
+    os.environ["DATABASE_PATH"] = os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    os.environ["WEBHOOK_URL"] = "https://benchmark.invalid"
+    os.environ["WEBHOOK_SECRET"] = SECRET
+    os.environ["WEBHOOK_WORKERS"] = str(args.workers)
+    os.environ["WEBHOOK_QUEUE_SIZE"] = str(args.queue_size)
+
+    import bot
+    from local_store import LocalDatabase
+    from tenants import Tenant, TenantRegistry
+
+    logging.getLogger().setLevel(logging.WARNING)
+    calls = ApiCalls()
+    gspread_client = FakeGspreadClient(calls, latency=args.sheets_latency)
+    tenants = []
+    for chat_id in sorted(chat_ids(updates)):
+        spreadsheet = gspread_client.add_spreadsheet(str(chat_id))
+        spreadsheet.add_worksheet("Schedule", make_event_rows(args.rows, 0, datetime.datetime.now(), args.seed)[0])
+        spreadsheet.add_worksheet("Birthdays", make_birthday_rows(args.rows, args.seed))
+        tenants.append(Tenant(chat_id, str(chat_id), "Schedule"))
+    bot.use_backends(sheets=FakeSheetsClient(gspread_client), telegram=FakeTelegram(calls, latency=args.telegram_latency),
+                     weather=FakeOpenMeteo(calls))
+    bot.connect_tenants(TenantRegistry(tenants), local_database=LocalDatabase(os.environ["DATABASE_PATH"]))
+    for tenant in tenants:
+        bot.sync_tenant(tenant)
+    bot.outbound_queue.start()
+    # start_webhook() without registering the webhook with Telegram
+    bot.webhook_enabled = True
+    return bot, calls
+
+
+def run(bot, updates, concurrency):
+    handled = []
+    lock = threading.Lock()
+    dispatcher = bot.update_dispatcher
+    process = dispatcher.process
+
+    def counted(update):
+        process(update)
+        with lock:
+            handled.append(update.update_id)
+
+    dispatcher.process = counted
+    bodies = [json.dumps(update) for update in updates]
+    statuses = {}
+
+    def client(part):
+        test_client = bot.app.test_client()
+        for body in bodies[part::concurrency]:
+            status = test_client.post(bot.WEBHOOK_PATH, data=body, content_type="application/json",
+                                      headers={"X-Telegram-Bot-Api-Secret-Token": SECRET}).status_code
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        list(clients.map(client, range(concurrency)))
+    posted = time.perf_counter() - started
+    dispatcher.shutdown(wait=True)
+    elapsed = time.perf_counter() - started
+    return statuses, len(handled), posted, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", help="JSON lines file with recorded updates")
+    parser.add_argument("--updates-count", type=int, default=2000, help="number of generated updates")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent webhook requests, like max_connections")
+    parser.add_argument("--workers", type=int, default=4, help="WEBHOOK_WORKERS")
+    parser.add_argument("--queue-size", type=int, default=100, help="WEBHOOK_QUEUE_SIZE")
+    parser.add_argument("--rows", type=int, default=1000, help="events and birthdays in the sheets of every chat")
+    parser.add_argument("--sheets-latency", type=float, default=0.2, help="seconds per Google Sheets call")
+    parser.add_argument("--telegram-latency", type=float, default=0.05, help="seconds per Telegram call")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) if args.updates else make_updates(args.updates_count)
+    bot, calls = set_up(updates, args)
+    before = calls.snapshot()
+    statuses, handled, posted, elapsed = run(bot, updates, args.concurrency)
+
+    print(f"updates: {len(updates)}  concurrency: {args.concurrency}  workers: {args.workers}  queue: {args.queue_size}")
+    print(f"responses: {', '.join(f'{status}: {count}' for status, count in sorted(statuses.items()))}")
+    print(f"accepted updates/s: {statuses.get(200, 0) / posted:9.1f}  (all requests answered in {posted:.2f} s)")
+    print(f"handled updates/s:  {handled / elapsed:9.1f}  ({handled} handled in {elapsed:.2f} s)")
+    print(f"API calls: {', '.join(f'{api}.{method}: {count}' for (api, method), count in sorted(calls.since(before).items()))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+It contains the index of birthdays from the "Birthdays" worksheet.
+"""
+
+import datetime
+import logging
+
+from event_store import SYNC_MODE_REVISION, SheetChangeTracker
+
+logger = logging.getLogger(__name__)
+
+HEADER_ROW = ["Person", "Date"]
+DATE_FORMAT = '%d.%m.%Y'
+
+
+def is_leap_year(year):
+    return year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+
+class BirthdayIndex:
+    """Birthdays of one chat in the local database, indexed by (month, day).
+
+    The table is rebuilt from the worksheet when it changes (see SheetChangeTracker);
+    refresh() is called by the Sheets sync thread, lookups only query the database.
+    People born on February 29 are congratulated on February 28 in non-leap years.
+    """
+
+    def __init__(self, worksheet, database, chat_id, refresh_interval=600, sync_mode=SYNC_MODE_REVISION):
+        self.worksheet = worksheet
+        self.database = database
+        self.chat_id = chat_id
+        self.tracker = SheetChangeTracker(worksheet, database, chat_id, "birthdays", refresh_interval, sync_mode)
+
+    def refresh(self, force=False):
+        """
+        Rebuilds the index if the worksheet has changed. Returns True if it was rebuilt.
+        """
+        download, revision = self.tracker.check(force)
+        if not download:
+            return False
+        birthdays = self._download()
+        with self.database.transaction() as connection:
+            connection.execute("DELETE FROM birthdays WHERE chat_id = ?", (self.chat_id,))
+            connection.executemany(
+                "INSERT INTO birthdays (chat_id, person, birth_date, month, day) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (self.chat_id, person, birth_date.isoformat(), birth_date.month, birth_date.day)
+                    for person, birth_date in birthdays
+                ],
+            )
+            self.tracker.downloaded(connection, revision)
+        logger.info(f"Birthday index of chat {self.chat_id} rebuilt: {len(birthdays)} people.")
+        return True
+
+    def on_day(self, date):
+        """
+        Returns list of (person, birth date) celebrating on date
+        """
+        days = [(date.month, date.day)]
+        if date.month == 2 and date.day == 28 and not is_leap_year(date.year):
+            days.append((2, 29))
+        people = []
+        for month, day in days:
+            rows = self.database.query(
+                "SELECT person, birth_date FROM birthdays WHERE chat_id = ? AND month = ? AND day = ? ORDER BY person",
+                (self.chat_id, month, day),
+            )
+            people += [(row["person"], datetime.date.fromisoformat(row["birth_date"])) for row in rows]
+        return people
+
+    def upcoming(self, days, today=None):
+        """
+        Returns list of (date, person, birth date) for the next days days, today included
+        """
+        if today is None:
+            today = datetime.date.today()
+        birthdays = []
+        for offset in range(days):
+            date = today + datetime.timedelta(days=offset)
+            for person, birth_date in self.on_day(date):
+                birthdays.append((date, person, birth_date))
+        return birthdays
+
+    def _download(self):
+        rows = self.worksheet.get_all_values()
+        # Check if the header row is present, if not, add it
+        if not rows or rows[0][:len(HEADER_ROW)] != HEADER_ROW:
+            self.worksheet.insert_row(HEADER_ROW, 1)
+            logger.info("Added header row to the Birthdays Google Sheet.")
+        else:
+            rows = rows[1:]
+        birthdays = []
+        for row in rows:
+            if len(row) < len(HEADER_ROW) or not row[1]:
+                continue
+            try:
+                birth_date = datetime.datetime.strptime(row[1], DATE_FORMAT).date()
+            except ValueError:
+                logger.warning(f"Skipping birthday of {row[0]} with invalid date {row[1]}")
+                continue
+            birthdays.append((row[0], birth_date))
+        return birthdays
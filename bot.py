@@ -1,20 +1,40 @@
 import logging
 import os
+import secrets
 import time
 import datetime
 from functools import wraps
 import telebot
 import threading
-import gspread
-from flask import Flask, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, Response, abort, jsonify
 import schedule
 
-from date_time import convert_to_datetime, get_remaining_time, convert_date, convert_time
-from weather_check import weather_one_time_forecast
+import weather_check
+from birthdays import BirthdayIndex
+from date_time import convert_date, convert_time
+from event_store import EventStore
+from local_store import LocalDatabase
+from metrics import LAG_BUCKETS, Counter, CallbackCounter, Gauge, Histogram, registry
+from recurrence import parse_recurrence, recurrence_of
+from reminder_scheduler import DEFAULT_OFFSETS, OFFSETS_PATTERN, ReminderScheduler, describe_offset, parse_offsets
+from send_queue import OutboundQueue
+from sheets_client import GoogleSheetsClient
+from tenants import Tenant, TenantRegistry, shard, shard_index
+from weather_check import weather_forecasts, find_location
+from webhook import WEBHOOK_PATH, UpdateDispatcher, handle_webhook_request
 
 
 TOKEN = os.environ.get('TOKEN')
-MY_CHAT_ID = int(os.environ.get('CHAT_ID'))
+MY_CHAT_ID = int(os.environ['CHAT_ID']) if os.environ.get('CHAT_ID') else None
+
+# JSON file with the list of chats served by the bot (see tenants.py), CHAT_ID is used when it is not set
+TENANTS_CONFIG = os.environ.get('TENANTS_CONFIG')
+# Number of notifier threads, chats are sharded between them by chat id
+NOTIFIER_WORKERS = int(os.environ.get('NOTIFIER_WORKERS', 1))
+NOTIFIER_RETRY_DELAY = 20
+# Default reminders before every event, chats and events can have their own
+REMINDER_OFFSETS = parse_offsets(os.environ.get('REMINDER_OFFSETS', DEFAULT_OFFSETS))
 
 # Google Sheets credentials
 GOOGLE_SHEETS_CREDS = os.environ.get('GOOGLE_SHEETS_CREDS')
@@ -22,14 +42,36 @@ GOOGLE_SPREADSHEET_ID = os.environ.get('GOOGLE_SPREADSHEET_ID')
 GOOGLE_SHEET_NAME = os.environ.get('GOOGLE_SHEET_NAME')
 GOOGLE_BIRTHDAY_SHEET_NAME = "Birthdays"
 
+# Time of the daily weather and birthdays notifications
+DAILY_CHECKS_TIME = "06:50"
+
+# Public HTTPS URL of the Flask app. When it is set updates come through the webhook instead of long polling
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 100))
+
+# Local database, Google Sheets is synced with it every EVENTS_REFRESH_INTERVAL seconds
+DATABASE_PATH = os.environ.get('DATABASE_PATH', 'scheduler.db')
+SYNC_WORKERS = int(os.environ.get('SYNC_WORKERS', 4))
+EVENTS_REFRESH_INTERVAL = int(os.environ.get('EVENTS_REFRESH_INTERVAL', 10))
+EVENTS_SYNC_MODE = os.environ.get('EVENTS_SYNC_MODE', 'revision')
+# Birthdays change rarely, their index is checked for changes less often
+BIRTHDAYS_REFRESH_INTERVAL = int(os.environ.get('BIRTHDAYS_REFRESH_INTERVAL', 600))
+MAX_UPCOMING_BIRTHDAYS_DAYS = 366
+
 scope = ['https://www.googleapis.com/auth/spreadsheets']
 
 help_message = '''You can run the following commands:
     /help - get help and support
-    /w    - get weather forecast (currently for Novi-Sad only)
-    /list - get all future events
-    /event EVENT_NAME DATE TIME - add a new event 
+    /w [CITY] - get weather forecast for the chat locations or for CITY
+    /list [today|week] - get future events, page by page
+    /b [N] - get birthdays for today or for the next N days
+    /event EVENT_NAME DATE TIME [REPEAT] [REMINDERS] - add a new event 
        example: "/event Doctor_appointment 01-11-2023 12:20"
+       REPEAT is daily, weekly, monthly, yearly or a rule like FREQ=WEEKLY;BYDAY=MO,TH;COUNT=10
+       REMINDERS are the times to remind before the event, like 2h,15m
+       several events can be added at once, one per line
     '''
 
 # Enable logging
@@ -38,50 +80,132 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Create an instance of the bot
-bot = telebot.TeleBot(TOKEN)
+# Create an instance of the bot. In webhook mode handlers run in the UpdateDispatcher pool instead of telebot's own
+bot = telebot.TeleBot(TOKEN, threaded=not WEBHOOK_URL)
+
+# Metrics exported by /metrics, Sheets and Open-Meteo calls are measured in sheets_client.py and weather_check.py
+telegram_latency = Histogram("telegram_request_seconds", "Telegram Bot API call latency", ["method"])
+command_latency = Histogram("command_handler_seconds", "Time to handle a command, sending the reply excluded", ["handler"])
+notifier_loop_latency = Histogram("notifier_loop_seconds", "Duration of one pass of a notifier worker over its chats", ["worker"])
+reminder_lag = Histogram("reminder_lag_seconds", "Delay between the deadline of a reminder and queueing it", buckets=LAG_BUCKETS)
+notifier_failures = Counter("notifier_failures_total", "Failed notifier passes over a chat", ["chat_id"])
+sync_latency = Histogram("sheets_sync_seconds", "Duration of one Google Sheets sync pass over all chats")
+sync_failures = Counter("sheets_sync_failures_total", "Failed Google Sheets syncs of a chat", ["chat_id"])
+
+# Client of the outgoing Bot API calls, use_backends() can replace it
+telegram_client = bot
+
+def deliver_message(chat_id, text, message_id=None, **kwargs):
+    """
+    Sends a new message, or edits message message_id of the chat if it is given
+    """
+    if message_id is not None:
+        with telegram_latency.time(method="editMessageText"):
+            return telegram_client.edit_message_text(text, chat_id, message_id, **kwargs)
+    with telegram_latency.time(method="sendMessage"):
+        return telegram_client.send_message(chat_id, text, **kwargs)
+
+# Every outgoing message goes through the queue, it keeps the bot within Telegram rate limits
+outbound_queue = OutboundQueue(deliver_message)
+
+def send_message(chat_id, text, coalesce=False):
+    outbound_queue.put(chat_id, text, coalesce=coalesce)
+
+def reply_to(message, text, **kwargs):
+    outbound_queue.put(message.chat.id, text, reply_to_message_id=message.message_id, **kwargs)
+
+def edit_message(chat_id, message_id, text, **kwargs):
+    outbound_queue.put(chat_id, text, message_id=message_id, **kwargs)
+
+Gauge("outbound_queue_depth", "Messages waiting in the outbound queue", function=outbound_queue.depth)
+CallbackCounter("telegram_messages_total", "Messages handled by the outbound queue by result", ["result"],
+                function=lambda: {("sent",): outbound_queue.sent, ("failed",): outbound_queue.failed,
+                                  ("coalesced",): outbound_queue.coalesced})
 
 app = Flask(__name__)
 
+# One authorized gspread session for all tenants, worksheets are resolved from it on demand
+sheets_client = GoogleSheetsClient(GOOGLE_SHEETS_CREDS)
+
 # Connect to Google Sheets
-def connect_to_google_sheet(sheet_name):
-    try:
-        gc = gspread.service_account(GOOGLE_SHEETS_CREDS)
-        spreadsheet = gc.open_by_key(GOOGLE_SPREADSHEET_ID)
-        worksheet = spreadsheet.worksheet(sheet_name)
-        return worksheet
-    except Exception as e:
-        logger.error(f"An error occurred while connecting : {str(e)}")
+def connect_to_google_sheet(sheet_name, spreadsheet_id=GOOGLE_SPREADSHEET_ID):
+    """
+    Returns a handle of the worksheet. The connection is made on its first use and re-made after failures.
+    """
+    return sheets_client.worksheet_handle(spreadsheet_id, sheet_name)
 
-event_worksheet = connect_to_google_sheet(GOOGLE_SHEET_NAME)
-birthday_worksheet = connect_to_google_sheet(GOOGLE_BIRTHDAY_SHEET_NAME)
+def load_tenants():
+    if TENANTS_CONFIG:
+        return TenantRegistry.from_config(TENANTS_CONFIG)
+    return TenantRegistry([Tenant(MY_CHAT_ID, GOOGLE_SPREADSHEET_ID, GOOGLE_SHEET_NAME, GOOGLE_BIRTHDAY_SHEET_NAME)])
+
+def use_backends(sheets=None, telegram=None, weather=None):
+    """
+    Replaces the clients of the external APIs, e.g. with the in-memory fakes of benchmarks/fakes.py.
+    sheets needs worksheet_handle() of GoogleSheetsClient, telegram send_message(), edit_message_text()
+    and answer_callback_query() of telebot.TeleBot, weather get() of requests.Session (Open-Meteo).
+    Call it before connect_tenants().
+    """
+    global sheets_client, telegram_client
+    if sheets is not None:
+        sheets_client = sheets
+    if telegram is not None:
+        telegram_client = telegram
+    if weather is not None:
+        weather_check.session = weather
+
+# Wake-up events of the notifier workers, all schedulers of a shard share one
+notifier_wakeups = [threading.Event() for _ in range(NOTIFIER_WORKERS)]
+
+# Local database with events, birthdays and notification state of all tenants, opened by connect_tenants()
+database = None
+
+def connect_tenant(tenant):
+    event_worksheet = connect_to_google_sheet(tenant.sheet_name, tenant.spreadsheet_id)
+    birthday_worksheet = connect_to_google_sheet(tenant.birthday_sheet_name, tenant.spreadsheet_id)
+    tenant.birthday_index = BirthdayIndex(birthday_worksheet, database, tenant.chat_id,
+                                          refresh_interval=BIRTHDAYS_REFRESH_INTERVAL, sync_mode=EVENTS_SYNC_MODE)
+    tenant.event_store = EventStore(event_worksheet, database, tenant.chat_id,
+                                    refresh_interval=EVENTS_REFRESH_INTERVAL, sync_mode=EVENTS_SYNC_MODE)
+    tenant.reminder_scheduler = ReminderScheduler(wakeup=notifier_wakeups[shard_index(tenant.chat_id, NOTIFIER_WORKERS)],
+                                                  offsets=tenant.reminder_offsets or REMINDER_OFFSETS)
+
+# Chats served by the bot, filled by connect_tenants()
+tenants = TenantRegistry()
+
+def connect_tenants(registry=None, local_database=None):
+    """
+    Opens the local database (DATABASE_PATH by default) and connects the tenants (load_tenants() by default)
+    to their worksheets. Nothing is requested from Google Sheets until the first sync.
+    """
+    global database
+    database = local_database if local_database is not None else LocalDatabase(DATABASE_PATH)
+    for tenant in registry if registry is not None else load_tenants():
+        connect_tenant(tenant)
+        tenants.add(tenant)
+
+Gauge("reminder_queue_depth", "Reminders waiting in the reminder queues of all chats",
+      function=lambda: sum(len(tenant.reminder_scheduler) for tenant in tenants))
 
 def restrict_chat_access(func):
     """
-    Allows access only for users from group with MY_CHAT_ID
+    Allows access only for users from groups registered in tenants
     """
     @wraps(func)
     def wrapper(message):
         chat_id = message.chat.id
-        if chat_id == MY_CHAT_ID:
-            return func(message)
+        if chat_id in tenants:
+            with command_latency.time(handler=func.__name__):
+                return func(message)
     return wrapper
 
-def update_spreadsheet(new_event, worksheet):
-    """
-    Writing new event details to the Google spreadsheet
-    """
-    rows = worksheet.get_all_records()
-    next_row = len(rows) + 1
-    worksheet.append_row(new_event, value_input_option='USER_ENTERED', table_range=f'A{next_row}:C{next_row}')
-
 # Handler for the /start command
 @bot.message_handler(commands=['start'])
 @restrict_chat_access
 def start(message):
     user = message.from_user
     logger.info(f"Received /start command from user: {user.username}")
-    bot.reply_to(message, f"Hi {user.first_name}!")
+    reply_to(message, f"Hi {user.first_name}!")
 
 @bot.message_handler(func=lambda message: message.new_chat_members is not None)
 @restrict_chat_access
@@ -95,42 +219,112 @@ def handle_new_chat_members(message):
 
         # Send welcome message
         welcome_message = f"Welcome, {username}! Feel free to explore and use the available commands."
-        bot.send_message(chat.id, welcome_message)
-        bot.send_message(chat.id, help_message)
-
-def send_notification_to_group(group_chat_id, event_name, remaining_time):
-    notification=f"Reminder: less than {remaining_time} until {event_name}"
-    bot.send_message(chat_id=group_chat_id, text=notification)
+        send_message(chat_id, welcome_message)
+        send_message(chat_id, help_message)
 
-def get_future_events():
-    current_datetime = datetime.datetime.now()
+def notification_text(event_name, remaining_time):
+    return f"Reminder: less than {remaining_time} until {event_name}"
 
-    events = event_worksheet.get_all_records()
-    future_events = []
+def send_notification_to_group(group_chat_id, event_name, remaining_time):
+    # Reminders of one chat due at the same time are sent as one message
+    send_message(group_chat_id, notification_text(event_name, remaining_time), coalesce=True)
 
-    for event in events:
-        event_datetime = convert_to_datetime(event['Date'], event['Time'])
-        if event_datetime > current_datetime:
-            future_events.append(event)
+def send_reminder(tenant, reminder):
+    """
+    Queues the reminder and adds its offset to Notification_status
+    """
+    reminder_lag.observe(max((datetime.datetime.now() - reminder.deadline).total_seconds(), 0))
+    send_notification_to_group(tenant.chat_id, reminder.event_name, reminder.remaining_time)
+    tenant.event_store.mark_notified(reminder.event_id, reminder.offset, reminder.occurrence)
+
+# Number of events on one /list page and filters of the /list command
+LIST_PAGE_SIZE = 10
+LIST_FILTERS = {
+    "all": "Future Events",
+    "today": "Events today",
+    "week": "Events in the next 7 days",
+}
+LIST_CALLBACK_PREFIX = "list "
+
+def list_period(list_filter, current_datetime):
+    """
+    Returns (start, end) of the events shown by /list list_filter, end is None for all future events
+    """
+    if list_filter == "today":
+        return current_datetime, datetime.datetime.combine(current_datetime.date() + datetime.timedelta(days=1), datetime.time())
+    if list_filter == "week":
+        return current_datetime, current_datetime + datetime.timedelta(days=7)
+    return current_datetime, None
+
+def list_button(text, list_filter, direction, event_time, event_id):
+    # Callback data is limited to 64 bytes: "list week next 1700000000.0 123"
+    callback_data = f"{LIST_CALLBACK_PREFIX}{list_filter} {direction} {event_time!r} {event_id}"
+    return telebot.types.InlineKeyboardButton(text, callback_data=callback_data)
+
+def list_page(tenant, list_filter="all", cursor=None, backward=False):
+    """
+    Returns text and inline keyboard (None if there is one page) of a /list page.
+    cursor is (event time, event id) of the event the page starts after, or ends before if backward.
+    """
+    start, end = list_period(list_filter, datetime.datetime.now())
+    page, has_previous, has_next = tenant.event_store.events_page(start, end, LIST_PAGE_SIZE, cursor, backward)
+    if not page:
+        return f"{LIST_FILTERS[list_filter]}: no events found.", None
+
+    lines = [f"{LIST_FILTERS[list_filter]}:\n"]
+    for _, _, event in page:
+        line = f"Event Name: {event['Name']}\nDate: {event['Date']}\nTime: {event['Time']}\n"
+        if event['Repeat']:
+            line += f"Repeats: {recurrence_of(event['Repeat']).describe()}\n"
+        if event['Reminders']:
+            line += f"Reminders: {describe_reminders(event['Reminders'])}\n"
+        lines.append(line)
+    buttons = []
+    if has_previous:
+        first_id, first_time, _ = page[0]
+        buttons.append(list_button("« Previous", list_filter, "prev", first_time, first_id))
+    if has_next:
+        last_id, last_time, _ = page[-1]
+        buttons.append(list_button("Next »", list_filter, "next", last_time, last_id))
+    keyboard = None
+    if buttons:
+        keyboard = telebot.types.InlineKeyboardMarkup()
+        keyboard.row(*buttons)
+    return "\n".join(lines), keyboard
+
+def list_response(tenant, command_text=""):
+    """
+    Returns text and inline keyboard of the first page of /list [all|today|week]
+    """
+    args = command_text.split()
+    list_filter = args[1].lower() if len(args) > 1 else "all"
+    if list_filter not in LIST_FILTERS:
+        return f"Usage: /list [{'|'.join(LIST_FILTERS)}]", None
+    return list_page(tenant, list_filter)
 
-    return future_events
+def list_callback_response(tenant, callback_data):
+    """
+    Returns text and inline keyboard of the /list page requested by a Next/Previous button
+    """
+    list_filter, direction, event_time, event_id = callback_data[len(LIST_CALLBACK_PREFIX):].split()
+    return list_page(tenant, list_filter, (float(event_time), int(event_id)), backward=direction == "prev")
 
 @bot.message_handler(commands=['list'])
 @restrict_chat_access
 def handle_list_command(message):
     user = message.from_user
     logger.info(f"Received /list command from user: {user.username}")
-
-    future_events = get_future_events()
-
-    if future_events:
-        response = "Future Events:\n\n"
-        for event in future_events:
-            response += f"Event Name: {event['Name']}\nDate: {event['Date']}\nTime: {event['Time']}\n\n"
-    else:
-        response = "No future events found."
-
-    bot.reply_to(message, response)
+    response, keyboard = list_response(tenants.get(message.chat.id), message.text)
+    reply_to(message, response, reply_markup=keyboard)
+
+@bot.callback_query_handler(func=lambda call: call.data.startswith(LIST_CALLBACK_PREFIX))
+def handle_list_page(call):
+    chat_id = call.message.chat.id
+    if chat_id not in tenants:
+        return
+    response, keyboard = list_callback_response(tenants.get(chat_id), call.data)
+    edit_message(chat_id, call.message.message_id, response, reply_markup=keyboard)
+    telegram_client.answer_callback_query(call.id)
 
 # Handler for the /help command
 @bot.message_handler(commands=['help'])
@@ -139,35 +333,97 @@ def help_command(message):
     user = message.from_user
     logger.info(f"Received /help command from user: {user.username}")
     response = help_message
-    bot.reply_to(message, response)
+    reply_to(message, response)
+
+def describe_reminders(text):
+    return ", ".join(describe_offset(offset) for offset in reversed(parse_offsets(text))) + " before"
+
+def event_options(options):
+    """
+    Returns [repeat, reminders] of the optional /event tokens, in any order. Raises ValueError for invalid ones.
+    """
+    repeat, reminders = "", ""
+    for option in options:
+        if OFFSETS_PATTERN.match(option.lower()) and not reminders:
+            parse_offsets(option)
+            reminders = option.lower()
+        elif not repeat:
+            parse_recurrence(option)
+            repeat = option
+        else:
+            raise ValueError(f"Unexpected event option: {option}")
+    return [repeat, reminders]
+
+def event_response(tenant, command_text):
+    """
+    Takes events from the /event command text (one event per line) and writes them to the Google Spreadsheet
+    with a single append request. Returns the reply for the user.
+    """
+    lines = [line for line in command_text.splitlines() if line.strip()]
+    new_events = []
+    for line in lines:
+        event_details = line.split()
+        if len(event_details) not in (3, 4, 5):
+            break
+        #converting date and time before writing in to event worksheet
+        try:
+            event_details[1] = convert_date(event_details[1])
+            event_details[2] = convert_time(event_details[2])
+            event_details[3:] = event_options(event_details[3:])
+        except ValueError:
+            break
+        new_events.append(event_details)
+
+    if not lines or len(new_events) != len(lines):
+        return ("Please provide event details in the format: event_name date time [repeat] [reminders] "
+                "(one event per line)")
+    try:
+        tenant.reminder_scheduler.schedule(tenant.event_store.append_events(new_events))
+        sync_wakeup.set()
+        response = ""
+        for event_name, date, time_value, repeat, reminders in new_events:
+            logger.info(f"New event {event_name} has been added to spreadsheet.")
+            response += f"Event has been added: Event Name - {event_name}, Date - {date}, Time - {time_value}"
+            if repeat:
+                response += f", Repeats - {parse_recurrence(repeat).describe()}"
+            if reminders:
+                response += f", Reminders - {describe_reminders(reminders)}"
+            response += "\n"
+    except Exception as e:
+        logger.error(f"An error occurred while updating the spreadsheet: {str(e)}")
+        response = f"FAILED to write new event. Error: {str(e)}"
+    return response
 
 # Handler for the /event command
 @bot.message_handler(commands=['event'])
 @restrict_chat_access
 def handle_event_command(message):
-    """
-    Takes event from users message and writes it to the Google Spreadsheet with update_spreadsheet method
-    """
     user = message.from_user
     logger.info(f"Received /event command from user: {user.username}")
-
     command_text = message.text.split("/event", 1)[-1].strip()
-    event_details = command_text.split()
-    #converting date and time before writing in to event worksheet
-    if len(event_details) == 3:
-        event_details[1] = convert_date(event_details[1])
-        event_details[2] = convert_time(event_details[2])
-        event_name, date, time = event_details
-        try:
-            update_spreadsheet(event_details, event_worksheet)
-            logger.info(f"New event {event_name} has been added to spreadsheet.")
-            response = f"Event has been added: Event Name - {event_name}, Date - {date}, Time - {time}"
-        except Exception as e:
-            logger.error(f"An error occurred while updating the spreadsheet: {str(e)}")
-            response = f"FAILED to write new event. Error: {str(e)}"
+    reply_to(message, event_response(tenants.get(message.chat.id), command_text))
+
+def weather_response(tenant, city=None):
+    """
+    Returns forecasts for CITY if it is given, otherwise for all locations of the tenant
+    """
+    if city:
+        location = find_location(city)
+        if location is None:
+            return f"Could not find location {city}"
+        locations = [location]
     else:
-        response = "Please provide event details in the format: event_name date time"
-    bot.reply_to(message, response)
+        locations = tenant.locations
+    return "\n".join(weather_forecasts(locations))
+
+def daily_forecasts():
+    """
+    Returns {chat_id: forecast text} for all tenants. Forecasts for all their locations are fetched together.
+    """
+    all_tenants = list(tenants)
+    locations = [location for tenant in all_tenants for location in tenant.locations]
+    forecasts = iter(weather_forecasts(locations))
+    return {tenant.chat_id: "\n".join(next(forecasts) for _ in tenant.locations) for tenant in all_tenants}
 
 # Handler for the /w (weather) command to check weather
 @bot.message_handler(commands=['w'])
@@ -175,8 +431,19 @@ def handle_event_command(message):
 def weather_check_command(message):
     user = message.from_user
     logger.info(f"Received /w command from user: {user.username}")
-    response = weather_one_time_forecast()
-    bot.reply_to(message, response)
+    city = message.text.split(maxsplit=1)[1] if len(message.text.split(maxsplit=1)) > 1 else None
+    reply_to(message, weather_response(tenants.get(message.chat.id), city))
+
+def birthdays_response(tenant, command_text):
+    """
+    Returns birthdays for today, or for the next N days for "/b N"
+    """
+    arguments = command_text.split()[1:]
+    if not arguments:
+        return check_birthdays(tenant.birthday_index)
+    if not arguments[0].isdigit() or not 0 < int(arguments[0]) <= MAX_UPCOMING_BIRTHDAYS_DAYS:
+        return f"Please provide number of days from 1 to {MAX_UPCOMING_BIRTHDAYS_DAYS}: /b 7"
+    return upcoming_birthdays(tenant.birthday_index, int(arguments[0]))
 
 # Handler for the /b (birthdays) command to check weather
 @bot.message_handler(commands=['b'])
@@ -184,112 +451,160 @@ def weather_check_command(message):
 def birthday_check_command(message):
     user = message.from_user
     logger.info(f"Received /b command from user: {user.username}")
-    bot.reply_to(message, check_birthdays())
+    reply_to(message, birthdays_response(tenants.get(message.chat.id), message.text))
 
-def check_events_and_notify():    
+def due_reminders(tenant):
+    """
+    Returns reminders of the tenant that are due now. The queue is rebuilt from the local database when
+    a sync pulled changed events, events added with /event are only pushed into it.
+    """
+    event_store = tenant.event_store
+    reminder_scheduler = tenant.reminder_scheduler
+    # Taken before the rebuild: the events are in the database already, so the rebuild includes them
+    event_ids = reminder_scheduler.take_scheduled()
+    if reminder_scheduler.version != event_store.version:
+        version = event_store.version
+        reminder_scheduler.rebuild(event_store.upcoming_events(), version)
+    elif event_ids:
+        reminder_scheduler.add(event_store.upcoming_events(ids=event_ids))
+    return reminder_scheduler.pop_due()
+
+def check_events_and_notify(worker_index=0):    
     """
     Description of check_events
 
-    Function checks current events in the spreadsheet and set Notification_status flag in Google Spreadsheet column D:
-    Notified_24hours - notification for 24h till the event has been sent 
-    Notified_4hours - notification for 4h  has been sent
-    Notified_1hour - notification for 1h has been sent
-
-    Returns:
-       notification_is_required (boolean): If True that means that notification needs to be sent
+    Function serves the tenants of one notifier worker (shard). It sleeps until the next reminder
+    of the shard is due (or events change), queues the due reminders and sets Notification_status
+    in the local database; the Sheets sync thread writes it to Google Spreadsheet column D.
+    Notification_status lists the reminders that have been sent, e.g. "Notified: 24h, 4h";
+    the reminder offsets come from the Reminders column (F), the chat config or REMINDER_OFFSETS.
+    Google Sheets is not used here, so reminders keep going during a Sheets outage.
     """
-    connection_failures = 0
-    
+    worker_tenants = shard(tenants, worker_index, NOTIFIER_WORKERS)
+    wakeup = notifier_wakeups[worker_index]
+    logger.info(f"Notifier worker {worker_index} serves {len(worker_tenants)} chats.")
+
     while True:
-        try:
-            # Check if the header row is present, if not, add it
-            header_row_values = ["Name", "Date", "Time", "Notification_status"]
-            header_row = event_worksheet.row_values(1)
-            if header_row != header_row_values:
-                event_worksheet.insert_row(header_row_values, 1)
-                logger.info("Added header row to the Google Sheet.")
-            notification_is_required = False
-            rows = event_worksheet.get_all_records()
-
-            # Get the values of date and time and notification
-            row_number = 2
-            for row in rows:
-                date_value = row['Date']
-                time_value = row['Time']
-                event_name = row['Name']
-                notification_status = row['Notification_status']     
-                datetime_value = convert_to_datetime(date_value, time_value) # Generate date and time value from the Google sheet
-                remaining_time = get_remaining_time(datetime_value) # Get remaining time until the event
-                if remaining_time != None:
-                    if 4 < remaining_time <= 24 and notification_status != "Notified_24hours":
-                        send_notification_to_group(MY_CHAT_ID, event_name, "24 hours")
-                        event_worksheet.update(f'D{row_number}', 'Notified_24hours')
-                    elif 1 < remaining_time <=4 and notification_status != "Notified_4hours":
-                        send_notification_to_group(MY_CHAT_ID, event_name, "4 hours")
-                        event_worksheet.update(f'D{row_number}', 'Notified_4hours')
-                    elif remaining_time <= 1 and notification_status != "Notified_1hour":
-                        send_notification_to_group(MY_CHAT_ID, event_name, "1 hour")
-                        event_worksheet.update(f'D{row_number}', 'Notified_1hour')
-                row_number += 1
-            time.sleep(10)
-        except Exception as e:
-            current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            logger.error(f"An error occurred in the check_events_and_notify function at {current_time}: {str(e)}")
-            connection_failures += 1
-            time.sleep(20)
-        if connection_failures == 3:
-            bot.send_message(chat_id=MY_CHAT_ID, text="Failed to connect to Google Sheet 3 times.")
-            connection_failures += 1
-        if connection_failures == 15:
-            bot.send_message(chat_id=MY_CHAT_ID, text="Failed to connect to Google Sheet 15 times. Bot stopped checking the schedule!")
-            #break
-
-def check_birthdays():
+        wakeup.clear()
+        delay = EVENTS_REFRESH_INTERVAL
+        with notifier_loop_latency.time(worker=str(worker_index)):
+            for tenant in worker_tenants:
+                try:
+                    for reminder in due_reminders(tenant):
+                        send_reminder(tenant, reminder)
+                except Exception as e:
+                    notifier_failures.inc(chat_id=tenant.chat_id)
+                    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                    logger.error(f"An error occurred in the check_events_and_notify function for chat {tenant.chat_id} at {current_time}: {str(e)}")
+                    # Reminders popped before the failure are re-queued from the stored statuses
+                    tenant.reminder_scheduler.invalidate()
+                    delay = min(delay, NOTIFIER_RETRY_DELAY)
+                    continue
+                next_due = tenant.reminder_scheduler.seconds_until_next()
+                if next_due is not None:
+                    delay = min(delay, next_due)
+        wakeup.wait(delay)
+
+def register_failure(tenant, error):
+    """
+    Counts a failed Google Sheets sync of the tenant. Returns an alert for the chat when one is needed.
+    """
+    current_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    logger.error(f"An error occurred while syncing chat {tenant.chat_id} with Google Sheet at {current_time}: {str(error)}")
+    sync_failures.inc(chat_id=tenant.chat_id)
+    tenant.retry_at = time.monotonic() + 20
+    failures = sync_failures.value(chat_id=tenant.chat_id)
+    if failures == 3:
+        return "Failed to connect to Google Sheet 3 times. Reminders keep working from the local database."
+    if failures == 15:
+        return "Failed to connect to Google Sheet 15 times. Changes made in the sheet are not seen by the bot!"
+    return None
+
+def sync_tenant(tenant):
+    """
+    Exchanges changes between the local database and Google Sheets for one tenant.
+    Returns an alert for the chat if the sync failed too many times.
+    """
+    if time.monotonic() < tenant.retry_at:
+        return None
+    try:
+        if tenant.event_store.sync():
+            tenant.reminder_scheduler.wake()
+        tenant.birthday_index.refresh()
+    except Exception as e:
+        return register_failure(tenant, e)
+    return None
+
+# Set to push new events to Google Sheets without waiting for the refresh interval
+sync_wakeup = threading.Event()
+
+def sync_with_google_sheets():
+    '''
+    Keeps Google Sheets and the local database of every tenant in sync, SYNC_WORKERS tenants at a time
+    '''
+    with ThreadPoolExecutor(max_workers=SYNC_WORKERS, thread_name_prefix="Sheets sync") as executor:
+        while True:
+            sync_wakeup.clear()
+            all_tenants = list(tenants)
+            with sync_latency.time():
+                alerts = list(executor.map(sync_tenant, all_tenants))
+            for tenant, alert in zip(all_tenants, alerts):
+                if alert:
+                    send_message(tenant.chat_id, alert)
+            sync_wakeup.wait(EVENTS_REFRESH_INTERVAL)
+
+def check_birthdays(birthday_index):
     '''
     Method returns list of birthdays in "Birthdays" worksheet for today
     '''
     try:
-        # Check if the header row is present, if not, add it
-        header_row_values = ["Person", "Date"]
-        header_row = birthday_worksheet.row_values(1)
-        if header_row != header_row_values:
-            birthday_worksheet.insert_row(header_row_values, 1)
-            logger.info("Added header row to the Birthdays Google Sheet.")
-
         now = datetime.datetime.now()
-        today_birthdays = []
+        today_birthdays = birthday_index.on_day(now.date())
         response = "No birthdays for today"
-        rows = birthday_worksheet.get_all_records()
-        for row in rows:
-            date = datetime.datetime.strptime(row['Date'], '%d.%m.%Y')
-            if date.day == now.day and date.month == now.month:
-                today_birthdays.append(row)
 
         if len(today_birthdays) > 0:
             response = "Here is the list of birthdays for today:\n"
-            for person in today_birthdays:
-                birth_date = datetime.datetime.strptime(person['Date'], '%d.%m.%Y').date()
+            for person, birth_date in today_birthdays:
                 age = int(now.year) - int(birth_date.year)
-                response += f"{person['Person']} - {birth_date.strftime('%d %B, %Y')} (Age: {age})\n"
+                response += f"{person} - {birth_date.strftime('%d %B, %Y')} (Age: {age})\n"
             return response
         return response
 
     except Exception as e:
         logger.error(f"An error occurred in the check_birthdays function: {str(e)}")
 
+def upcoming_birthdays(birthday_index, days):
+    '''
+    Method returns list of birthdays in "Birthdays" worksheet for the next days days
+    '''
+    try:
+        birthdays = birthday_index.upcoming(days)
+        if not birthdays:
+            return f"No birthdays in the next {days} days"
+        response = f"Here is the list of birthdays in the next {days} days:\n"
+        for date, person, birth_date in birthdays:
+            age = date.year - birth_date.year
+            response += f"{date.strftime('%d %B')} - {person} (Age: {age})\n"
+        return response
+
+    except Exception as e:
+        logger.error(f"An error occurred in the upcoming_birthdays function: {str(e)}")
+
 def daily_checks():
     '''
     Schedule 2 sub methods that check and send notifications about weather and birthdays for today
     '''
     def send_weather_forecast():
-        bot.send_message(chat_id=MY_CHAT_ID, text=weather_one_time_forecast())
+        for chat_id, forecast in daily_forecasts().items():
+            send_message(chat_id, forecast)
         logger.info("Weather forecast has been sent.")
-    schedule.every().day.at("06:50").do(send_weather_forecast)
+    schedule.every().day.at(DAILY_CHECKS_TIME).do(send_weather_forecast)
 
     def send_birthday_notification():
-            bot.send_message(chat_id=MY_CHAT_ID, text=check_birthdays())
+            for tenant in tenants:
+                send_message(tenant.chat_id, check_birthdays(tenant.birthday_index))
             logger.info("Birthday notifications with ages have been sent.")
-    schedule.every().day.at("06:50").do(send_birthday_notification)
+    schedule.every().day.at(DAILY_CHECKS_TIME).do(send_birthday_notification)
     while True:
         schedule.run_pending()
         time.sleep(50)
@@ -318,24 +633,75 @@ def check_thread_liveness(threads):
     else:
         return jsonify(status='ERROR', message=f'Threads not alive: {", ".join(dead_threads)}'), 500
 
+# Threads (or objects with the same is_alive()/name interface) reported by /health
+health_threads = []
+
 @app.route('/health')
 def health_check():
-    threads = [check_events_thread, check_birthdays_thread, bot_thread, weather_check_daily_thread]
-    return check_thread_liveness(threads)
+    return check_thread_liveness(health_threads)
+
+@app.route('/metrics')
+def metrics():
+    return Response(registry.render(), mimetype="text/plain; version=0.0.4")
+
+update_dispatcher = UpdateDispatcher(lambda update: bot.process_new_updates([update]),
+                                     workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE)
+Gauge("webhook_updates_in_flight", "Webhook updates being processed or waiting for a worker", function=update_dispatcher.in_flight)
+CallbackCounter("webhook_updates_total", "Webhook updates by result", ["result"],
+                function=lambda: {("accepted",): update_dispatcher.accepted, ("rejected",): update_dispatcher.rejected})
+# Set by start_webhook(), the webhook route answers 404 in long polling mode
+webhook_enabled = False
+
+@app.route(WEBHOOK_PATH, methods=['POST'])
+def telegram_webhook():
+    if not webhook_enabled:
+        abort(404)
+    return handle_webhook_request(update_dispatcher, WEBHOOK_SECRET)
+
+def start_webhook():
+    """
+    Registers WEBHOOK_URL with Telegram. Telegram opens at most WEBHOOK_WORKERS connections to it at once.
+    Without WEBHOOK_SECRET a random secret is generated, so the route only accepts updates sent by Telegram.
+    """
+    global webhook_enabled, WEBHOOK_SECRET
+    if not WEBHOOK_SECRET:
+        # Telegram accepts A-Z, a-z, 0-9, _ and - in the secret token
+        WEBHOOK_SECRET = secrets.token_urlsafe(32)
+        logger.info("WEBHOOK_SECRET is not set, generated a random webhook secret.")
+    webhook_enabled = True
+    bot.remove_webhook()
+    bot.set_webhook(url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET,
+                    max_connections=WEBHOOK_WORKERS)
+    logger.info(f"Receiving updates through the webhook at {WEBHOOK_URL}.")
 
 if __name__ == "__main__":
-    check_events_thread = threading.Thread(target=check_events_and_notify, name="Check events thread")
-    check_events_thread.start()
+    connect_tenants()
 
-    bot_thread = threading.Thread(target=bot.infinity_polling, name="Telegram Bot thread")
-    bot_thread.start()
+    check_events_threads = [
+        threading.Thread(target=check_events_and_notify, args=(worker_index,), name=f"Check events thread {worker_index}")
+        for worker_index in range(NOTIFIER_WORKERS)
+    ]
+    for check_events_thread in check_events_threads:
+        check_events_thread.start()
+
+    sync_thread = threading.Thread(target=sync_with_google_sheets, name="Google Sheets sync thread")
+    sync_thread.start()
+
+    if WEBHOOK_URL:
+        start_webhook()
+    else:
+        # getUpdates does not work while a webhook is set
+        bot.remove_webhook()
+        bot_thread = threading.Thread(target=bot.infinity_polling, name="Telegram Bot thread")
+        bot_thread.start()
+        health_threads.append(bot_thread)
 
     daily_checks_thread = threading.Thread(target=daily_checks, name="Weather and birthdays check thread")
     daily_checks_thread.start()
 
+    send_queue_thread = outbound_queue.start()
+
+    health_threads.extend(check_events_threads + [sync_thread, daily_checks_thread, send_queue_thread])
+
     # Run the Flask application
     app.run()
-
-    check_events_thread.start()
-    bot_thread.start()
-    daily_checks_thread.start()
\ No newline at end of file
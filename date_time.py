@@ -3,18 +3,35 @@ It contains methods for manipulating with date and time formats and values.
 """
 
 import datetime
+from functools import lru_cache
 
 def convert_date(date_input):
     '''
     Converts date_input and returns it to format day.month.year
     '''
-    current_year = datetime.datetime.now().year  # Get the current year
+    return _parse_date(date_input, datetime.datetime.now().year).strftime("%d.%m.%Y")
 
-    # Determine the date format based on the delimiter used
+def convert_time(time_input):
+    # Convert time input
+    if '-' in time_input:
+        time_input = time_input.replace("-", ":")
+
+    time_obj = datetime.datetime.strptime(time_input, "%H:%M").time()
+    return time_obj.strftime("%H:%M")
+
+def convert_to_datetime(date_input, time_input):
+    formatted_date = convert_date(date_input)
+    formatted_time = convert_time(time_input)
+    datetime_obj = datetime.datetime.strptime(f"{formatted_date} {formatted_time}", "%d.%m.%Y %H:%M")
+    return datetime_obj
+
+@lru_cache(maxsize=4096)
+def _parse_date(date_input, current_year):
+    # "day.month[.year]" or "day-month[-year]", the current year if it is missing
     delimiter = '-' if '-' in date_input else '.' if '.' in date_input else None
     if delimiter is None:
         raise ValueError("Invalid date format")
-    
+
     # Parse the date input using the appropriate format
     date_parts = date_input.split(delimiter)
     if len(date_parts) == 2:  # If the user input does not include the year
@@ -24,36 +41,32 @@ def convert_date(date_input):
         day, month, year = map(int, date_parts)
     else:
         raise ValueError("Invalid date format")
-    
+
     if year < 100:
         year += 2000  # Add 2000 to the two-digit year to get the full year
-    return datetime.datetime(year, month, day).strftime("%d.%m.%Y")
+    return datetime.date(year, month, day)
 
-def convert_time(time_input):
-    # Convert time input
-    if '-' in time_input:
-        time_input = time_input.replace("-", ":")
+@lru_cache(maxsize=2048)
+def _parse_time(time_input):
+    # Same rules as convert_time: "HH:MM" or "HH-MM"
+    time_parts = time_input.replace("-", ":").split(":")
+    if len(time_parts) != 2 or not all(part.isdigit() and 0 < len(part) <= 2 for part in time_parts):
+        raise ValueError(f"time data {time_input!r} does not match format '%H:%M'")
+    return datetime.time(int(time_parts[0]), int(time_parts[1]))
 
-    time_obj = datetime.datetime.strptime(time_input, "%H:%M").time()
-    return time_obj.strftime("%H:%M")
-
-def convert_to_datetime(date_input, time_input):
-    formatted_date = convert_date(date_input)
-    formatted_time = convert_time(time_input)
-    datetime_obj = datetime.datetime.strptime(f"{formatted_date} {formatted_time}", "%d.%m.%Y %H:%M")
-    return datetime_obj
-
-def get_remaining_time(datetime_value):
-    time_delta = None
-    current_datetime = datetime.datetime.now()
-
-    if datetime_value > current_datetime:
-        time_difference = datetime_value - current_datetime
-        if time_difference <= datetime.timedelta(hours=24) and time_difference > datetime.timedelta(hours=4):
-            time_delta = 24
-        elif time_difference <= datetime.timedelta(hours=4) and time_difference > datetime.timedelta(hours=1):
-            time_delta = 4
-        elif time_difference <= datetime.timedelta(hours=1):
-            time_delta = 1
-    
-    return time_delta
+def parse_datetimes(dates, times, epoch=False):
+    '''
+    Converts whole Date and Time columns into datetimes (or epoch seconds if epoch is True) in one pass.
+    Every distinct date and time string is parsed once. Values that can not be parsed become None.
+    '''
+    current_year = datetime.datetime.now().year
+    combine = datetime.datetime.combine
+    results = []
+    for date_input, time_input in zip(dates, times):
+        try:
+            datetime_value = combine(_parse_date(str(date_input), current_year), _parse_time(str(time_input)))
+        except (ValueError, TypeError):
+            results.append(None)
+            continue
+        results.append(datetime_value.timestamp() if epoch else datetime_value)
+    return results
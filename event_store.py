@@ -0,0 +1,519 @@
+"""
+It contains the event store of a chat: events live in the local database and are mirrored to the events worksheet.
+"""
+
+import datetime
+import logging
+import heapq
+import itertools
+import re
+import time
+
+from gspread.exceptions import APIError
+
+from date_time import parse_datetimes
+from recurrence import LOOKAHEAD, recurrence_of
+from reminder_scheduler import format_status, offsets_of, parse_status
+from sheets_client import request_failures, request_latency
+
+logger = logging.getLogger(__name__)
+
+HEADER_ROW = ["Name", "Date", "Time", "Notification_status", "Repeat", "Reminders"]
+# Sheets made before repeating events and reminder offsets were supported have only these columns
+LEGACY_HEADER_ROW = HEADER_ROW[:4]
+EVENT_COLUMNS = "id, name, date, time, notification_status, recurrence, reminder_offsets"
+# Notification statuses of occurrences are kept this long after the occurrence
+OCCURRENCE_STATUS_RETENTION = datetime.timedelta(days=2)
+DRIVE_FILES_URL = "https://www.googleapis.com/drive/v3/files"
+
+SYNC_MODE_INTERVAL = "interval"
+SYNC_MODE_REVISION = "revision"
+
+STATUS_COLUMN = "D"
+APPENDED_RANGE_PATTERN = re.compile(r"![A-Z]+(\d+)")
+FLUSH_RETRIES = 5
+FLUSH_BACKOFF = 1  # seconds, doubled after every failed attempt
+
+
+def fetch_revision(worksheet):
+    """
+    Returns the Drive revision of the spreadsheet that contains worksheet. It changes with every edit.
+    """
+    spreadsheet = worksheet.spreadsheet
+    try:
+        with request_latency.time(operation="revision"):
+            response = spreadsheet.client.request(
+                "get", f"{DRIVE_FILES_URL}/{spreadsheet.id}", params={"fields": "version"}
+            )
+    except Exception:
+        request_failures.inc(operation="revision")
+        raise
+    return response.json()["version"]
+
+
+def is_retryable_error(error):
+    """
+    Returns True for rate limit (429) and server side (5xx) Sheets API errors.
+    """
+    status_code = getattr(getattr(error, "response", None), "status_code", None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def call_with_backoff(function, *args, retries=FLUSH_RETRIES, backoff=FLUSH_BACKOFF, **kwargs):
+    """
+    Calls a Sheets API function, rate limit and server errors are retried with exponential backoff.
+    """
+    attempt = 0
+    while True:
+        try:
+            return function(*args, **kwargs)
+        except APIError as e:
+            attempt += 1
+            if attempt > retries or not is_retryable_error(e):
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            logger.warning(f"Google Sheets request failed ({str(e)}), retrying in {delay} seconds.")
+            time.sleep(delay)
+
+
+class SheetChangeTracker:
+    """Decides when a worksheet mirrored to the local database has to be downloaded again.
+
+    interval - the sheet is re-downloaded every refresh_interval seconds
+    revision - every refresh_interval seconds only the Drive revision of the
+               spreadsheet is requested and the sheet is re-downloaded when it changed
+
+    The revision of the last download is kept in the database, so a restart does not
+    re-download a sheet that has not changed.
+    """
+
+    def __init__(self, worksheet, database, chat_id, sheet, refresh_interval, sync_mode):
+        if sync_mode not in (SYNC_MODE_INTERVAL, SYNC_MODE_REVISION):
+            raise ValueError(f"Unknown sync mode: {sync_mode}")
+        self.worksheet = worksheet
+        self.database = database
+        self.chat_id = chat_id
+        self.sheet = sheet
+        self.refresh_interval = refresh_interval
+        self.sync_mode = sync_mode
+        self._last_check = None
+
+    def is_stale(self):
+        if self._last_check is None:
+            return True
+        return time.monotonic() - self._last_check >= self.refresh_interval
+
+    def check(self, force=False):
+        """
+        Returns (download needed, revision to save after the download).
+        """
+        if not force and not self.is_stale():
+            return False, None
+        revision = None
+        if self.sync_mode == SYNC_MODE_REVISION:
+            revision = str(fetch_revision(self.worksheet))
+            if not force and revision == self.database.get_revision(self.chat_id, self.sheet):
+                self._last_check = time.monotonic()
+                return False, None
+        return True, revision
+
+    def downloaded(self, connection, revision):
+        """
+        Saves the revision in the same transaction as the downloaded data.
+        """
+        self.database.set_revision(connection, self.chat_id, self.sheet, revision)
+        self._last_check = time.monotonic()
+
+    def write(self, function, *args, **kwargs):
+        """
+        Calls function, a write of the bot to the sheet, and returns its result. If nobody else changed
+        the spreadsheet since the last download, the revision after the write is saved as downloaded,
+        so check() does not download the bot's own changes again.
+        """
+        if self.sync_mode != SYNC_MODE_REVISION:
+            return function(*args, **kwargs)
+        unchanged = str(fetch_revision(self.worksheet)) == self.database.get_revision(self.chat_id, self.sheet)
+        result = function(*args, **kwargs)
+        if unchanged:
+            revision = str(fetch_revision(self.worksheet))
+            with self.database.transaction() as connection:
+                self.downloaded(connection, revision)
+        return result
+
+
+class EventStore:
+    """Events of one chat in the local database, mirrored to the events worksheet.
+
+    The notifier, /list and /event only read and write the database, so they keep working
+    and stay fast while Google Sheets is slow or down. sync() (run by the Sheets sync thread)
+    exchanges changes with the sheet in both directions:
+
+    push - events added with /event are appended with one append request, and changed
+           Notification_status values are written with one batch_update
+    pull - the sheet is re-downloaded when SheetChangeTracker says it changed. Statuses that
+           are not written to the sheet yet win over the downloaded ones. The pushes do not
+           count as changes unless somebody else edited the spreadsheet too.
+
+    Events are identified by their database id; row_number is their row in the sheet
+    (row 1 is the header) and stays NULL until the event is appended.
+
+    A repeating event is one row with a rule in the Repeat column. Its occurrences are generated
+    on demand (occurrences(), upcoming_events(), events_page()) and never written anywhere; their
+    notification statuses are kept in the occurrence_status table of the local database only.
+    """
+
+    def __init__(self, worksheet, database, chat_id, refresh_interval=10, sync_mode=SYNC_MODE_REVISION):
+        self.worksheet = worksheet
+        self.database = database
+        self.chat_id = chat_id
+        self.tracker = SheetChangeTracker(worksheet, database, chat_id, "events", refresh_interval, sync_mode)
+        self.version = 0  # bumped every time a pull from the sheet changes the events (not their statuses)
+
+    def upcoming_events(self, current_datetime=None, ids=None):
+        """
+        Returns list of (event id, event) pairs of the events after current_datetime, ordered by their time,
+        only the events with the given ids if ids is not None.
+        A repeating event is returned once, as its next occurrence with the notification status of that occurrence.
+        """
+        if current_datetime is None:
+            current_datetime = datetime.datetime.now()
+        conditions = "chat_id = ? AND recurrence = '' AND event_time > ?"
+        params = [self.chat_id, current_datetime.timestamp()]
+        if ids is not None:
+            ids = list(ids)
+            conditions += f" AND id IN ({', '.join('?' * len(ids))})"
+            params += ids
+        rows = self.database.query(
+            f"SELECT {EVENT_COLUMNS}, event_time FROM events WHERE {conditions} ORDER BY event_time, id",
+            params,
+        )
+        events = [(row["event_time"], row["id"], self._event(row)) for row in rows]
+        recurring_rows = self._recurring_rows()
+        if ids is not None:
+            recurring_rows = [row for row in recurring_rows if row["id"] in ids]
+        statuses = self._occurrence_statuses(current_datetime) if recurring_rows else {}
+        for row in recurring_rows:
+            start = datetime.datetime.fromtimestamp(row["event_time"])
+            occurrence = recurrence_of(row["recurrence"]).next_after(start, current_datetime)
+            if occurrence is not None:
+                events.append((occurrence.timestamp(), row["id"], self._occurrence_event(row, occurrence, statuses)))
+        events.sort(key=lambda item: item[:2])
+        return [(event_id, event) for _, event_id, event in events]
+
+    def occurrences(self, after, before=None):
+        """
+        Generates (event id, occurrence time, event) for the occurrences of repeating events
+        with after < occurrence < before (None - no limit) ordered by time. They are expanded lazily.
+        """
+        recurring_rows = self._recurring_rows()
+        statuses = self._occurrence_statuses(after, before) if recurring_rows else {}
+
+        def expand(row):
+            start = datetime.datetime.fromtimestamp(row["event_time"])
+            for occurrence in recurrence_of(row["recurrence"]).occurrences(start, after, before):
+                yield occurrence.timestamp(), row["id"], occurrence, row
+
+        expansions = [expand(row) for row in recurring_rows]
+        for occurrence_time, event_id, occurrence, row in heapq.merge(*expansions, key=lambda item: item[:2]):
+            yield event_id, occurrence_time, self._occurrence_event(row, occurrence, statuses)
+
+    def events_page(self, start, end=None, limit=10, cursor=None, backward=False):
+        """
+        Returns one page of the events with start < event time < end (end None - no limit) ordered by time,
+        as (page, has_previous, has_next), page is a list of (event id, event time, event).
+        cursor is (event time, event id) of the event the page starts after, or ends before if backward;
+        one-off events are read from the event_time index, so the page costs O(limit) however far it is
+        from the first one. Repeating events are expanded into occurrences up to end, or for LOOKAHEAD.
+        """
+        conditions = ["chat_id = ?", "recurrence = ''", "event_time > ?"]
+        params = [self.chat_id, start.timestamp()]
+        if end is not None:
+            conditions.append("event_time < ?")
+            params.append(end.timestamp())
+        if cursor is not None:
+            conditions.append("(event_time, id) < (?, ?)" if backward else "(event_time, id) > (?, ?)")
+            params += list(cursor)
+        order = "DESC" if backward else "ASC"
+        rows = self.database.query(
+            f"SELECT {EVENT_COLUMNS}, event_time FROM events "
+            f"WHERE {' AND '.join(conditions)} ORDER BY event_time {order}, id {order} LIMIT ?",
+            params + [limit + 1],
+        )
+        items = [(row["id"], row["event_time"], self._event(row)) for row in rows]
+        items += self._page_occurrences(start, end if end is not None else start + LOOKAHEAD, limit + 1, cursor, backward)
+        items.sort(key=lambda item: (item[1], item[0]), reverse=backward)
+        more = len(items) > limit
+        page = items[:limit]
+        if backward:
+            return page[::-1], more, True
+        return page, cursor is not None, more
+
+    def _page_occurrences(self, start, end, count, cursor, backward):
+        # At most count occurrences next to the cursor, in the paging direction
+        if cursor is None:
+            return list(itertools.islice(self.occurrences(start, end), count))
+        cursor_time = datetime.datetime.fromtimestamp(cursor[0])
+        if backward:
+            before = min(end, cursor_time + datetime.timedelta(seconds=1))
+            occurrences = [item for item in self.occurrences(start, before) if (item[1], item[0]) < cursor]
+            return occurrences[-count:]
+        after = max(start, cursor_time - datetime.timedelta(seconds=1))
+        occurrences = (item for item in self.occurrences(after, end) if (item[1], item[0]) > cursor)
+        return list(itertools.islice(occurrences, count))
+
+    def append_events(self, rows):
+        """
+        Adds [Name, Date, Time, Repeat, Reminders] rows (Repeat and Reminders are optional) to the database.
+        They are appended to the sheet by the next sync(). Returns ids of the new events; version is not
+        bumped, the caller passes the ids to ReminderScheduler.schedule() instead of forcing a rebuild.
+        """
+        event_times = parse_datetimes([row[1] for row in rows], [row[2] for row in rows], epoch=True)
+        ids = []
+        with self.database.transaction() as connection:
+            for row, event_time in zip(rows, event_times):
+                name, date, time_value, recurrence, reminder_offsets = (list(row) + ["", ""])[:5]
+                cursor = connection.execute(
+                    "INSERT INTO events (chat_id, name, date, time, event_time, recurrence, reminder_offsets) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (self.chat_id, name, date, time_value, event_time, recurrence, reminder_offsets),
+                )
+                ids.append(cursor.lastrowid)
+        return ids
+
+    def mark_notified(self, event_id, offset, occurrence=None):
+        """
+        Adds offset (minutes) to the reminders sent for the event and marks its Notification_status
+        for the next flush_statuses(). The sent offsets are a set, so marking twice changes nothing.
+        For an occurrence of a repeating event the status is kept in the local database only.
+        """
+        with self.database.transaction() as connection:
+            if occurrence is not None:
+                rows = connection.execute(
+                    "SELECT notification_status FROM occurrence_status WHERE event_id = ? AND occurrence_time = ?",
+                    (event_id, occurrence.timestamp()),
+                ).fetchall()
+                sent = parse_status(rows[0]["notification_status"]) if rows else frozenset()
+                connection.execute(
+                    "INSERT OR REPLACE INTO occurrence_status (event_id, occurrence_time, notification_status) "
+                    "VALUES (?, ?, ?)",
+                    (event_id, occurrence.timestamp(), format_status(sent | {offset})),
+                )
+                return
+            rows = connection.execute("SELECT notification_status FROM events WHERE id = ?", (event_id,)).fetchall()
+            if not rows:
+                return
+            sent = parse_status(rows[0]["notification_status"])
+            if offset in sent:
+                return
+            connection.execute(
+                "UPDATE events SET notification_status = ?, status_dirty = 1 WHERE id = ?",
+                (format_status(sent | {offset}), event_id),
+            )
+
+    def sync(self, force=False):
+        """
+        Pushes local changes to the sheet, then pulls the sheet if it changed. Returns True if events changed.
+        """
+        self.push_events()
+        self.flush_statuses()
+        self.prune_occurrence_statuses()
+        return self.refresh(force)
+
+    def prune_occurrence_statuses(self, current_datetime=None):
+        """
+        Forgets notification statuses of occurrences that are over
+        """
+        if current_datetime is None:
+            current_datetime = datetime.datetime.now()
+        with self.database.transaction() as connection:
+            # Statuses exist only for repeating events, the subquery reads the events_recurring index
+            connection.execute(
+                "DELETE FROM occurrence_status WHERE occurrence_time < ? "
+                "AND event_id IN (SELECT id FROM events WHERE chat_id = ? AND recurrence != '')",
+                ((current_datetime - OCCURRENCE_STATUS_RETENTION).timestamp(), self.chat_id),
+            )
+
+    def push_events(self, retries=FLUSH_RETRIES, backoff=FLUSH_BACKOFF):
+        """
+        Appends all events that are not in the sheet yet with a single Sheets append request.
+        The append API finds the end of the table itself, so the sheet is not read before writing.
+        """
+        pending = self.database.query(
+            f"SELECT {EVENT_COLUMNS} FROM events "
+            "WHERE chat_id = ? AND row_number IS NULL ORDER BY id",
+            (self.chat_id,),
+        )
+        if not pending:
+            return 0
+        rows = [
+            [row["name"], row["date"], row["time"], row["notification_status"], row["recurrence"], row["reminder_offsets"]]
+            for row in pending
+        ]
+        response = self.tracker.write(
+            call_with_backoff, self.worksheet.append_rows, rows, value_input_option='USER_ENTERED', table_range='A1',
+            retries=retries, backoff=backoff,
+        )
+        first_row = int(APPENDED_RANGE_PATTERN.search(response["updates"]["updatedRange"]).group(1))
+        with self.database.transaction() as connection:
+            # Rows known under these numbers are outdated, the next pull brings them back if they still exist
+            connection.execute(
+                "DELETE FROM events WHERE chat_id = ? AND row_number BETWEEN ? AND ?",
+                (self.chat_id, first_row, first_row + len(pending) - 1),
+            )
+            for offset, row in enumerate(pending):
+                # The status went out with the row, it stays dirty only if it changed since
+                connection.execute(
+                    "UPDATE events SET row_number = ?, "
+                    "status_dirty = CASE WHEN notification_status = ? THEN 0 ELSE status_dirty END WHERE id = ?",
+                    (first_row + offset, row["notification_status"], row["id"]),
+                )
+        logger.info(f"Appended {len(pending)} events to the Google Sheet of chat {self.chat_id}.")
+        return len(pending)
+
+    def flush_statuses(self, retries=FLUSH_RETRIES, backoff=FLUSH_BACKOFF):
+        """
+        Writes all changed Notification_status values to the sheet with a single batch_update.
+        Rate limit and server errors are retried with exponential backoff. If the flush still
+        fails the statuses stay marked for the next call and the error is raised.
+        """
+        pending = self.database.query(
+            "SELECT id, row_number, notification_status FROM events "
+            "WHERE chat_id = ? AND status_dirty = 1 AND row_number IS NOT NULL ORDER BY row_number",
+            (self.chat_id,),
+        )
+        if not pending:
+            return 0
+        data = [
+            {"range": f"{STATUS_COLUMN}{row['row_number']}", "values": [[row['notification_status']]]}
+            for row in pending
+        ]
+        self.tracker.write(call_with_backoff, self.worksheet.batch_update, data, retries=retries, backoff=backoff)
+        with self.database.transaction() as connection:
+            # Keep the rows that were changed again while the request was in flight
+            connection.executemany(
+                "UPDATE events SET status_dirty = 0 WHERE id = ? AND notification_status = ?",
+                [(row["id"], row["notification_status"]) for row in pending],
+            )
+        logger.info(f"Flushed {len(data)} notification statuses to the Google Sheet of chat {self.chat_id}.")
+        return len(data)
+
+    def refresh(self, force=False):
+        """
+        Downloads the worksheet into the database if it changed. Returns True if events changed.
+        """
+        download, revision = self.tracker.check(force)
+        if not download:
+            return False
+        rows = self._download()
+        event_times = parse_datetimes([row[1] for row in rows], [row[2] for row in rows], epoch=True)
+        changed = False
+        with self.database.transaction() as connection:
+            local = {
+                row["row_number"]: row
+                for row in connection.execute(
+                    "SELECT id, row_number, name, date, time, notification_status, status_dirty, recurrence, reminder_offsets "
+                    "FROM events WHERE chat_id = ? AND row_number IS NOT NULL",
+                    (self.chat_id,),
+                )
+            }
+            for index, (row, event_time) in enumerate(zip(rows, event_times)):
+                row_number = index + 2
+                name, date, time_value, status, recurrence, reminder_offsets = row[:6]
+                # Invalid rules and offsets are logged and ignored, the event gets no repeats and the chat's reminders
+                recurrence = recurrence.strip() if recurrence_of(recurrence.strip()) is not None else ""
+                reminder_offsets = reminder_offsets.strip() if offsets_of(reminder_offsets.strip()) is not None else ""
+                existing = local.pop(row_number, None)
+                if existing is None:
+                    connection.execute(
+                        "INSERT INTO events (chat_id, row_number, name, date, time, notification_status, event_time, "
+                        "recurrence, reminder_offsets) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (self.chat_id, row_number, name, date, time_value, status, event_time, recurrence, reminder_offsets),
+                    )
+                    changed = True
+                    continue
+                if existing["status_dirty"]:
+                    status = existing["notification_status"]
+                schedule = (existing["date"], existing["time"], existing["recurrence"])
+                current = (existing["name"], existing["notification_status"], existing["reminder_offsets"]) + schedule
+                if current != (name, status, reminder_offsets, date, time_value, recurrence):
+                    connection.execute(
+                        "UPDATE events SET name = ?, date = ?, time = ?, notification_status = ?, event_time = ?, "
+                        "recurrence = ?, reminder_offsets = ? WHERE id = ?",
+                        (name, date, time_value, status, event_time, recurrence, reminder_offsets, existing["id"]),
+                    )
+                    if schedule != (date, time_value, recurrence):
+                        connection.execute("DELETE FROM occurrence_status WHERE event_id = ?", (existing["id"],))
+                    changed = True
+            # Rows that are not in the sheet any more
+            if local:
+                removed = [(row["id"],) for row in local.values()]
+                connection.executemany("DELETE FROM events WHERE id = ?", removed)
+                connection.executemany("DELETE FROM occurrence_status WHERE event_id = ?", removed)
+                changed = True
+            self.tracker.downloaded(connection, revision)
+        if changed:
+            self.version += 1
+            logger.info(f"Events of chat {self.chat_id} reloaded from the Google Sheet: {len(rows)} events.")
+        return changed
+
+    def _download(self):
+        # One request for the header and the data instead of row_values(1) + get_all_records()
+        rows = self.worksheet.get_all_values()
+        if not rows or rows[0][:len(LEGACY_HEADER_ROW)] != LEGACY_HEADER_ROW:
+            self.worksheet.insert_row(HEADER_ROW, 1)
+            logger.info("Added header row to the Google Sheet.")
+        else:
+            for column in range(len(LEGACY_HEADER_ROW), len(HEADER_ROW)):
+                if rows[0][column:column + 1] != [HEADER_ROW[column]]:
+                    self.worksheet.update_cell(1, column + 1, HEADER_ROW[column])
+                    logger.info(f"Added {HEADER_ROW[column]} column to the Google Sheet.")
+            rows = rows[1:]
+        return [row + [""] * (len(HEADER_ROW) - len(row)) for row in rows]
+
+    def _recurring_rows(self):
+        # Read from the partial events_recurring index, a condition on event_time would make
+        # the planner scan all events of the chat through events_event_time instead
+        rows = self.database.query(
+            f"SELECT {EVENT_COLUMNS}, event_time FROM events WHERE chat_id = ? AND recurrence != ''",
+            (self.chat_id,),
+        )
+        return [row for row in rows if row["event_time"] is not None]
+
+    def _occurrence_statuses(self, after, before=None):
+        # One primary key range per repeating event of the chat, with after < occurrence < before
+        conditions = "event_id IN (SELECT id FROM events WHERE chat_id = ? AND recurrence != '') AND occurrence_time > ?"
+        params = [self.chat_id, after.timestamp()]
+        if before is not None:
+            conditions += " AND occurrence_time < ?"
+            params.append(before.timestamp())
+        rows = self.database.query(
+            f"SELECT event_id, occurrence_time, notification_status FROM occurrence_status WHERE {conditions}",
+            params,
+        )
+        return {(row["event_id"], row["occurrence_time"]): row["notification_status"] for row in rows}
+
+    @staticmethod
+    def _event(row):
+        return {
+            "Name": row["name"],
+            "Date": row["date"],
+            "Time": row["time"],
+            "Notification_status": row["notification_status"],
+            "Repeat": row["recurrence"],
+            "Reminders": row["reminder_offsets"],
+            "Event_time": datetime.datetime.fromtimestamp(row["event_time"]),
+        }
+
+    @staticmethod
+    def _occurrence_event(row, occurrence, statuses):
+        # The event as it looks on the day of the occurrence
+        return {
+            "Name": row["name"],
+            "Date": occurrence.strftime("%d.%m.%Y"),
+            "Time": occurrence.strftime("%H:%M"),
+            "Notification_status": statuses.get((row["id"], occurrence.timestamp()), ""),
+            "Repeat": row["recurrence"],
+            "Reminders": row["reminder_offsets"],
+            "Event_time": occurrence,
+            "Series_start": datetime.datetime.fromtimestamp(row["event_time"]),
+        }
@@ -0,0 +1,108 @@
+"""
+It contains the local SQLite database: the primary store of events, birthdays and notification state.
+Google Sheets is a mirror of it, kept in sync by EventStore.sync() and BirthdayIndex.refresh().
+"""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY,
+    chat_id INTEGER NOT NULL,
+    row_number INTEGER,                          -- NULL until the event is appended to the sheet
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    notification_status TEXT NOT NULL DEFAULT '',  -- reminders sent, e.g. "Notified: 24h, 4h"
+    event_time REAL,                             -- epoch seconds, NULL if Date/Time can not be parsed
+    status_dirty INTEGER NOT NULL DEFAULT 0,     -- 1 if notification_status is not written to the sheet yet
+    recurrence TEXT NOT NULL DEFAULT '',         -- recurrence rule (see recurrence.py), '' for one-off events
+    reminder_offsets TEXT NOT NULL DEFAULT ''    -- e.g. "2h,15m", '' - the reminder offsets of the chat
+);
+CREATE UNIQUE INDEX IF NOT EXISTS events_row_number ON events (chat_id, row_number);
+CREATE INDEX IF NOT EXISTS events_event_time ON events (chat_id, event_time);
+CREATE INDEX IF NOT EXISTS events_notification_status ON events (chat_id, notification_status);
+CREATE INDEX IF NOT EXISTS events_status_dirty ON events (chat_id) WHERE status_dirty = 1;
+CREATE INDEX IF NOT EXISTS events_not_appended ON events (chat_id) WHERE row_number IS NULL;
+
+-- Notification state of the occurrences of repeating events, the occurrences themselves are not stored
+CREATE TABLE IF NOT EXISTS occurrence_status (
+    event_id INTEGER NOT NULL,
+    occurrence_time REAL NOT NULL,               -- epoch seconds
+    notification_status TEXT NOT NULL,
+    PRIMARY KEY (event_id, occurrence_time)
+);
+
+CREATE TABLE IF NOT EXISTS birthdays (
+    chat_id INTEGER NOT NULL,
+    person TEXT NOT NULL,
+    birth_date TEXT NOT NULL,                    -- ISO format
+    month INTEGER NOT NULL,
+    day INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS birthdays_day ON birthdays (chat_id, month, day);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    chat_id INTEGER NOT NULL,
+    sheet TEXT NOT NULL,
+    revision TEXT,
+    PRIMARY KEY (chat_id, sheet)
+);
+'''
+
+
+class LocalDatabase:
+    """
+    One SQLite connection shared by all threads, access is serialized with a lock.
+    """
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.row_factory = sqlite3.Row
+        self._lock = threading.RLock()
+        with self._lock:
+            if path != ":memory:":
+                self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        # Databases created before repeating events and reminder offsets were supported
+        columns = {row["name"] for row in self._connection.execute("PRAGMA table_info(events)")}
+        for column in ("recurrence", "reminder_offsets"):
+            if column not in columns:
+                self._connection.execute(f"ALTER TABLE events ADD COLUMN {column} TEXT NOT NULL DEFAULT ''")
+        # Created here rather than in SCHEMA, the recurrence column may have just been added
+        self._connection.execute("CREATE INDEX IF NOT EXISTS events_recurring ON events (chat_id) WHERE recurrence != ''")
+        self._connection.commit()
+
+    @contextmanager
+    def transaction(self):
+        """
+        Yields the connection; everything executed in the block is committed together or rolled back.
+        """
+        with self._lock:
+            with self._connection:
+                yield self._connection
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self._connection.execute(sql, params).fetchall()
+
+    def get_revision(self, chat_id, sheet):
+        rows = self.query("SELECT revision FROM sync_state WHERE chat_id = ? AND sheet = ?", (chat_id, sheet))
+        return rows[0]["revision"] if rows else None
+
+    def set_revision(self, connection, chat_id, sheet, revision):
+        connection.execute(
+            "INSERT OR REPLACE INTO sync_state (chat_id, sheet, revision) VALUES (?, ?, ?)",
+            (chat_id, sheet, revision),
+        )
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
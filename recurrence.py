@@ -0,0 +1,206 @@
+"""
+It contains recurrence rules of repeating events and the lazy expansion of their occurrences.
+
+A rule is "daily", "weekly", "monthly", "yearly" or a subset of RFC 5545 RRULE:
+FREQ=DAILY|WEEKLY|MONTHLY|YEARLY with optional INTERVAL, BYDAY (weekly only, e.g. MO,WE),
+COUNT and UNTIL (YYYYMMDD or YYYYMMDDTHHMMSS), e.g. "FREQ=WEEKLY;INTERVAL=2;BYDAY=MO,TH;COUNT=10".
+The first occurrence is the Date/Time of the event, also when its weekday is not in BYDAY,
+and it counts towards COUNT.
+"""
+
+import calendar
+import datetime
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+# Occurrences of repeating events further away than this are not listed by /list without a period
+LOOKAHEAD = datetime.timedelta(days=31)
+
+
+def add_months(year, month, months):
+    month_index = year * 12 + month - 1 + months
+    return month_index // 12, month_index % 12 + 1
+
+
+def parse_until(value):
+    value = value.rstrip("Z")
+    for date_format in ("%Y%m%dT%H%M%S", "%Y%m%d"):
+        try:
+            until = datetime.datetime.strptime(value, date_format)
+        except ValueError:
+            continue
+        # A date without time includes the whole day
+        return until if "T" in value else until.replace(hour=23, minute=59, second=59)
+    raise ValueError(f"Invalid UNTIL value: {value}")
+
+
+class Recurrence:
+    """
+    A parsed recurrence rule. occurrences() generates the occurrences one by one, starting
+    from the period that contains after, so no occurrence is stored anywhere.
+    """
+
+    def __init__(self, frequency, interval=1, weekdays=None, count=None, until=None):
+        if frequency not in FREQUENCIES:
+            raise ValueError(f"Unknown frequency: {frequency}")
+        if interval < 1 or (count is not None and count < 1):
+            raise ValueError("INTERVAL and COUNT must be positive")
+        if weekdays and frequency != "WEEKLY":
+            raise ValueError("BYDAY is supported only for weekly events")
+        self.frequency = frequency
+        self.interval = interval
+        self.weekdays = sorted(set(weekdays)) if weekdays else None
+        self.count = count
+        self.until = until
+
+    def __repr__(self):
+        return (f"Recurrence({self.frequency!r}, interval={self.interval}, weekdays={self.weekdays}, "
+                f"count={self.count}, until={self.until})")
+
+    def describe(self):
+        """
+        Returns the rule in words for /list, e.g. "every 2 weeks on Mon, Thu"
+        """
+        units = {"DAILY": "day", "WEEKLY": "week", "MONTHLY": "month", "YEARLY": "year"}
+        unit = units[self.frequency]
+        text = f"every {self.interval} {unit}s" if self.interval > 1 else f"every {unit}"
+        if self.weekdays:
+            text += " on " + ", ".join(calendar.day_abbr[weekday] for weekday in self.weekdays)
+        if self.count:
+            text += f", {self.count} times"
+        if self.until:
+            text += f", until {self.until.strftime('%d.%m.%Y')}"
+        return text
+
+    def _period(self, start, index):
+        """
+        Returns (start of the period, occurrences in it) for period index, occurrences can be before start
+        """
+        if self.frequency == "DAILY":
+            occurrence = start + datetime.timedelta(days=index * self.interval)
+            return occurrence, [occurrence]
+        if self.frequency == "WEEKLY":
+            base = start + datetime.timedelta(weeks=index * self.interval)
+            if not self.weekdays:
+                return base, [base]
+            monday = base - datetime.timedelta(days=base.weekday())
+            occurrences = [monday + datetime.timedelta(days=weekday) for weekday in self.weekdays]
+            # The first occurrence is the start even on a day missing from BYDAY, like DTSTART in RFC 5545
+            if index == 0 and start not in occurrences:
+                occurrences = sorted(occurrences + [start])
+            return monday, occurrences
+        if self.frequency == "MONTHLY":
+            year, month = add_months(start.year, start.month, index * self.interval)
+        else:
+            year, month = start.year + index * self.interval, start.month
+        period_start = start.replace(year=year, month=month, day=1)
+        # Months (or years) without the day of the first occurrence are skipped, like RFC 5545 does
+        if start.day > calendar.monthrange(year, month)[1]:
+            return period_start, []
+        return period_start, [period_start.replace(day=start.day)]
+
+    def _periods_before(self, start, after):
+        """
+        Returns a period index that does not contain occurrences later than after
+        """
+        if after <= start:
+            return 0
+        if self.frequency == "DAILY":
+            periods = (after - start).days // self.interval
+        elif self.frequency == "WEEKLY":
+            periods = (after - start).days // (7 * self.interval)
+        elif self.frequency == "MONTHLY":
+            periods = ((after.year - start.year) * 12 + after.month - start.month) // self.interval
+        else:
+            periods = (after.year - start.year) // self.interval
+        return max(periods - 1, 0)
+
+    def occurrences(self, start, after=None, before=None):
+        """
+        Yields the occurrences later than after and earlier than before (None - no limit), in order
+        """
+        index = 0
+        if self.count is None and after is not None:
+            # COUNT needs every occurrence from the first one, without it whole periods are skipped
+            index = self._periods_before(start, after)
+        number = 0
+        while True:
+            period_start, occurrences = self._period(start, index)
+            if before is not None and period_start >= before:
+                return
+            if self.until is not None and period_start > self.until:
+                return
+            for occurrence in occurrences:
+                if occurrence < start:
+                    continue
+                if self.until is not None and occurrence > self.until:
+                    return
+                if self.count is not None:
+                    if number >= self.count:
+                        return
+                    number += 1
+                if before is not None and occurrence >= before:
+                    return
+                if after is None or occurrence > after:
+                    yield occurrence
+            index += 1
+
+    def next_after(self, start, after):
+        """
+        Returns the first occurrence later than after, None if there is none
+        """
+        return next(self.occurrences(start, after), None)
+
+
+def parse_recurrence(text):
+    """
+    Returns Recurrence for a rule, None for an empty one. Raises ValueError for invalid rules.
+    """
+    text = text.strip()
+    if not text:
+        return None
+    upper = text.upper()
+    if upper in FREQUENCIES:
+        return Recurrence(upper)
+    if upper.startswith("RRULE:"):
+        upper = upper[len("RRULE:"):]
+    parts = {}
+    for part in upper.split(";"):
+        name, separator, value = part.partition("=")
+        if not separator or not value:
+            raise ValueError(f"Invalid recurrence rule: {text}")
+        parts[name] = value
+    unknown = set(parts) - {"FREQ", "INTERVAL", "BYDAY", "COUNT", "UNTIL"}
+    if unknown or "FREQ" not in parts:
+        raise ValueError(f"Unsupported recurrence rule: {text}")
+    if "COUNT" in parts and "UNTIL" in parts:
+        raise ValueError("COUNT and UNTIL can not be used together")
+    weekdays = None
+    if "BYDAY" in parts:
+        try:
+            weekdays = [WEEKDAYS.index(day) for day in parts["BYDAY"].split(",")]
+        except ValueError:
+            raise ValueError(f"Invalid BYDAY value: {parts['BYDAY']}")
+    return Recurrence(
+        parts["FREQ"],
+        interval=int(parts.get("INTERVAL", 1)),
+        weekdays=weekdays,
+        count=int(parts["COUNT"]) if "COUNT" in parts else None,
+        until=parse_until(parts["UNTIL"]) if "UNTIL" in parts else None,
+    )
+
+
+@lru_cache(maxsize=1024)
+def recurrence_of(text):
+    """
+    Memoized parse_recurrence for rules read from the sheet, invalid rules give None
+    """
+    try:
+        return parse_recurrence(text)
+    except ValueError as e:
+        logger.warning(f"Ignoring recurrence rule {text!r}: {str(e)}")
+        return None
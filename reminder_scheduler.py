@@ -0,0 +1,267 @@
+"""
+It contains the deadline-ordered scheduler for event reminders and the reminder offsets.
+"""
+
+import bisect
+import datetime
+import heapq
+import logging
+import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
+
+from recurrence import recurrence_of
+
+logger = logging.getLogger(__name__)
+
+# Reminder offsets are minutes before the event, written like "24h,4h,1h" or "2d,30m"
+DEFAULT_OFFSETS = "24h,4h,1h"
+OFFSETS_PATTERN = re.compile(r"^\d+[dhm](,\d+[dhm])*$")
+OFFSET_UNITS = {"d": 24 * 60, "h": 60, "m": 1}
+
+# Notification_status holds the set of offsets whose reminders were sent, e.g. "Notified: 24h, 4h".
+# Values written before offsets were configurable name the last stage sent; the earlier ones are implied.
+STATUS_PREFIX = "Notified: "
+LEGACY_STATUSES = {
+    "Notified_24hours": frozenset({1440}),
+    "Notified_4hours": frozenset({1440, 240}),
+    "Notified_1hour": frozenset({1440, 240, 60}),
+}
+
+# deadline is the moment the reminder became due, the notifier reports how late it was sent.
+# occurrence is the date and time of the occurrence for repeating events, None for one-off events.
+Reminder = namedtuple("Reminder", ["event_id", "event_name", "remaining_time", "offset", "deadline", "occurrence"])
+
+
+def parse_offsets(text):
+    """
+    Returns offsets in minutes sorted in ascending order. Raises ValueError for invalid ones.
+    """
+    text = text.replace(" ", "").lower()
+    if not OFFSETS_PATTERN.match(text):
+        raise ValueError(f"Invalid reminder offsets: {text}")
+    offsets = {int(part[:-1]) * OFFSET_UNITS[part[-1]] for part in text.split(",")}
+    if 0 in offsets:
+        raise ValueError("Reminder offsets must be positive")
+    return tuple(sorted(offsets))
+
+
+@lru_cache(maxsize=1024)
+def offsets_of(text):
+    """
+    Memoized parse_offsets for offsets read from the sheet, empty and invalid ones give None
+    """
+    if not text.strip():
+        return None
+    try:
+        return parse_offsets(text)
+    except ValueError as e:
+        logger.warning(f"Ignoring reminder offsets {text!r}: {str(e)}")
+        return None
+
+
+def format_offset(minutes):
+    """
+    Returns the short form of an offset: 1440 -> "24h", 90 -> "90m"
+    """
+    return f"{minutes // 60}h" if minutes % 60 == 0 else f"{minutes}m"
+
+
+def describe_offset(minutes):
+    """
+    Returns the offset in words for the reminder text: 1440 -> "24 hours", 90 -> "1 hour 30 minutes"
+    """
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    if hours:
+        parts.append(f"{hours} hour" + ("s" if hours > 1 else ""))
+    if minutes:
+        parts.append(f"{minutes} minute" + ("s" if minutes > 1 else ""))
+    return " ".join(parts)
+
+
+def parse_status(status):
+    """
+    Returns the set of offsets (minutes) whose reminders were sent according to Notification_status
+    """
+    status = status.strip()
+    if status in LEGACY_STATUSES:
+        return LEGACY_STATUSES[status]
+    if not status.startswith(STATUS_PREFIX):
+        return frozenset()
+    try:
+        return frozenset(parse_offsets(status[len(STATUS_PREFIX):]))
+    except ValueError:
+        return frozenset()
+
+
+def format_status(sent):
+    if not sent:
+        return ""
+    return STATUS_PREFIX + ", ".join(format_offset(minutes) for minutes in sorted(sent, reverse=True))
+
+
+def reminder_stage(remaining, offsets):
+    """
+    Returns the offset whose reminder is due when remaining time is left: the smallest offset
+    that is not shorter than remaining. None if remaining is longer than every offset.
+    """
+    index = bisect.bisect_left(offsets, remaining / datetime.timedelta(minutes=1))
+    return offsets[index] if index < len(offsets) else None
+
+
+def next_reminder_deadline(event_datetime, sent, current_datetime, offsets):
+    """
+    Returns the moment the event needs its next reminder: current_datetime if the reminder of
+    the current stage has not been sent yet, otherwise the start of the next stage with an unsent
+    reminder. None means that no more reminders are needed.
+    """
+    if event_datetime <= current_datetime:
+        return None
+    remaining = event_datetime - current_datetime
+    stage = reminder_stage(remaining, offsets)
+    if stage is not None and stage not in sent:
+        return current_datetime
+    # Stages that have not started yet are the offsets shorter than remaining, the longest one starts first
+    index = bisect.bisect_left(offsets, remaining / datetime.timedelta(minutes=1))
+    for offset in reversed(offsets[:index]):
+        if offset not in sent:
+            return event_datetime - datetime.timedelta(minutes=offset)
+    return None
+
+
+def next_occurrence_deadline(event_datetime, sent, series, current_datetime, offsets):
+    """
+    Returns (deadline, occurrence, sent offsets) of the next reminder of the event. For a repeating event
+    (series is (Recurrence, first occurrence)) the following occurrences are tried once the current one
+    needs no more reminders. Returns None if no reminders are needed any more.
+    """
+    while True:
+        deadline = next_reminder_deadline(event_datetime, sent, current_datetime, offsets)
+        if deadline is not None:
+            return deadline, event_datetime, sent
+        if series is None:
+            return None
+        recurrence, start = series
+        event_datetime = recurrence.next_after(start, max(event_datetime, current_datetime))
+        if event_datetime is None:
+            return None
+        sent = frozenset()
+
+
+class ReminderScheduler:
+    """Priority queue of events keyed on their next reminder deadline.
+
+    The queue is built once per pull of the event store from the sheet; events added with /event
+    are pushed into it with add(), so a wake-up only touches the reminders that are due instead
+    of every event in the sheet. Deadlines are computed from the event times kept in the database.
+    A repeating event has one entry for its next occurrence; when that occurrence needs
+    no more reminders the entry moves on to the following one.
+    Events are reminded offsets minutes before they start unless they have their own Reminders.
+    """
+
+    def __init__(self, wakeup=None, offsets=parse_offsets(DEFAULT_OFFSETS)):
+        self.offsets = offsets
+        self.version = None  # version of the event store the queue was built from
+        self._queue = []
+        self._scheduled = set()  # ids of events added to the event store since the last take_scheduled()
+        self._lock = threading.Lock()
+        # Several schedulers can share one event when a single notifier worker serves them
+        self._wakeup = wakeup if wakeup is not None else threading.Event()
+
+    def rebuild(self, events, version=None, current_datetime=None):
+        """
+        Replaces the queue with the (event id, event) pairs from the event store.
+        """
+        queue = self._entries(events, current_datetime)
+        heapq.heapify(queue)
+        with self._lock:
+            self._queue = queue
+            self.version = version
+
+    def add(self, events, current_datetime=None):
+        """
+        Pushes the (event id, event) pairs of new events into the queue.
+        """
+        entries = self._entries(events, current_datetime)
+        with self._lock:
+            for entry in entries:
+                heapq.heappush(self._queue, entry)
+
+    def schedule(self, event_ids):
+        """
+        Remembers events added to the event store for the notifier, which adds them to the queue
+        (see take_scheduled()), and wakes it up.
+        """
+        with self._lock:
+            self._scheduled.update(event_ids)
+        self.wake()
+
+    def take_scheduled(self):
+        """
+        Returns and forgets the ids passed to schedule() since the last call.
+        """
+        with self._lock:
+            event_ids, self._scheduled = self._scheduled, set()
+        return event_ids
+
+    def invalidate(self):
+        """
+        Forces a rebuild on the next notifier iteration.
+        """
+        self.version = None
+        self.wake()
+
+    def pop_due(self, current_datetime=None):
+        """
+        Removes and returns the reminders whose deadline has come.
+        """
+        if current_datetime is None:
+            current_datetime = datetime.datetime.now()
+        due = []
+        with self._lock:
+            while self._queue and self._queue[0][0] <= current_datetime:
+                deadline, event_id, event_datetime, event_name, sent, series, offsets = heapq.heappop(self._queue)
+                stage = None
+                if event_datetime > current_datetime:
+                    stage = reminder_stage(event_datetime - current_datetime, offsets)
+                if stage is not None and stage not in sent:
+                    occurrence = event_datetime if series is not None else None
+                    due.append(Reminder(event_id, event_name, describe_offset(stage), stage, deadline, occurrence))
+                    sent = sent | {stage}
+                entry = next_occurrence_deadline(event_datetime, sent, series, current_datetime, offsets)
+                if entry is not None:
+                    deadline, event_datetime, sent = entry
+                    heapq.heappush(self._queue, (deadline, event_id, event_datetime, event_name, sent, series, offsets))
+        return due
+
+    def __len__(self):
+        return len(self._queue)
+
+    def seconds_until_next(self, current_datetime=None):
+        if current_datetime is None:
+            current_datetime = datetime.datetime.now()
+        with self._lock:
+            if not self._queue:
+                return None
+            return max((self._queue[0][0] - current_datetime).total_seconds(), 0)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def _entries(self, events, current_datetime=None):
+        if current_datetime is None:
+            current_datetime = datetime.datetime.now()
+        entries = []
+        for event_id, event in events:
+            series = None
+            if event.get('Repeat'):
+                series = (recurrence_of(event['Repeat']), event['Series_start'])
+            offsets = offsets_of(event.get('Reminders', '')) or self.offsets
+            sent = parse_status(event['Notification_status'])
+            entry = next_occurrence_deadline(event['Event_time'], sent, series, current_datetime, offsets)
+            if entry is not None:
+                deadline, event_datetime, sent = entry
+                entries.append((deadline, event_id, event_datetime, event['Name'], sent, series, offsets))
+        return entries
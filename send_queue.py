@@ -0,0 +1,205 @@
+"""
+It contains the outbound Telegram message queue with rate limiting, coalescing and retries.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows about 30 messages per second overall and about one per second in a chat
+GLOBAL_RATE = 30
+CHAT_RATE = 1
+CHAT_BURST = 3
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = 1  # seconds, doubled after every failed attempt
+# Longer texts are rejected by Telegram with 400 Bad Request
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TokenBucket:
+    """
+    Allows rate events per second on average with bursts of up to capacity events
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _fill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """
+        Returns seconds until a token is available
+        """
+        self._fill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now):
+        self._fill(now)
+        self.tokens -= 1
+
+
+class OutboundMessage:
+    __slots__ = ("chat_id", "text", "kwargs", "coalesce", "attempts")
+
+    def __init__(self, chat_id, text, kwargs, coalesce):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.coalesce = coalesce
+        self.attempts = 0
+
+
+def split_text(text, limit=MAX_MESSAGE_LENGTH):
+    """
+    Splits text into parts of at most limit characters, at line breaks where possible
+    """
+    parts = []
+    while len(text) > limit:
+        end = text.rfind("\n", 0, limit + 1)
+        if end <= 0:
+            parts.append(text[:limit])
+            text = text[limit:]
+        else:
+            parts.append(text[:end])
+            text = text[end + 1:]
+    parts.append(text)
+    return parts
+
+
+def telegram_retry_after(error):
+    """
+    Returns retry_after of a Telegram 429 error (ApiTelegramException), None for other errors
+    """
+    if getattr(error, "error_code", None) != 429:
+        return None
+    result = getattr(error, "result_json", None) or {}
+    return result.get("parameters", {}).get("retry_after", 1)
+
+
+def is_permanent_error(error):
+    # Bad request, bot blocked or kicked from the chat, etc. will not succeed on retry
+    error_code = getattr(error, "error_code", None)
+    return error_code is not None and 400 <= error_code < 500 and error_code != 429
+
+
+class OutboundQueue:
+    """Central queue for every message the bot sends.
+
+    A worker thread delivers the messages, chats are served round robin. Every chat has its
+    own token bucket and all chats share a global one. A Telegram 429 pauses the chat for
+    retry_after seconds, other errors are retried with exponential backoff. Consecutive
+    messages put with coalesce=True (reminders) are sent to a chat as one message, as long as
+    it fits into MAX_MESSAGE_LENGTH. Longer texts are split into several messages.
+    """
+
+    def __init__(self, send, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 max_attempts=MAX_ATTEMPTS, backoff=RETRY_BACKOFF):
+        self.send = send
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.sent = 0
+        self.failed = 0
+        self.coalesced = 0
+        self._chats = OrderedDict()  # chat_id -> deque of messages, in round robin order
+        self._buckets = {}
+        self._paused_until = {}  # chat_id -> time.monotonic() after a 429 or a failed attempt
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._condition = threading.Condition()
+
+    def put(self, chat_id, text, coalesce=False, **kwargs):
+        """
+        Queues a message, kwargs are passed to the send function (e.g. reply_to_message_id).
+        The parts of a text split by split_text() after the first one are sent as new messages without kwargs.
+        """
+        parts = split_text(text)
+        with self._condition:
+            messages = self._chats.setdefault(chat_id, deque())
+            messages.append(OutboundMessage(chat_id, parts[0], kwargs, coalesce))
+            messages.extend(OutboundMessage(chat_id, part, {}, coalesce) for part in parts[1:])
+            self._condition.notify()
+
+    def depth(self):
+        with self._condition:
+            return sum(len(messages) for messages in self._chats.values())
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="Telegram send queue thread", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        while True:
+            self._deliver(self._next())
+
+    def _next(self):
+        """
+        Waits until a message may be sent and takes it from the queue
+        """
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                wait = None
+                global_wait = self._global_bucket.wait_time(now)
+                for chat_id, messages in self._chats.items():
+                    bucket = self._buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+                    chat_wait = max(bucket.wait_time(now), self._paused_until.get(chat_id, 0) - now, global_wait)
+                    if chat_wait <= 0:
+                        message = self._pop(chat_id, messages)
+                        bucket.consume(now)
+                        self._global_bucket.consume(now)
+                        return message
+                    wait = chat_wait if wait is None else min(wait, chat_wait)
+                self._condition.wait(wait)
+
+    def _pop(self, chat_id, messages):
+        message = messages.popleft()
+        if message.coalesce:
+            texts = [message.text]
+            length = len(message.text)
+            while messages and messages[0].coalesce and length + 1 + len(messages[0].text) <= MAX_MESSAGE_LENGTH:
+                length += 1 + len(messages[0].text)
+                texts.append(messages.popleft().text)
+            if len(texts) > 1:
+                self.coalesced += len(texts) - 1
+                message.text = "\n".join(texts)
+        if messages:
+            self._chats.move_to_end(chat_id)
+        else:
+            del self._chats[chat_id]
+        return message
+
+    def _requeue(self, message, delay):
+        with self._condition:
+            self._paused_until[message.chat_id] = time.monotonic() + delay
+            self._chats.setdefault(message.chat_id, deque()).appendleft(message)
+            self._condition.notify()
+
+    def _deliver(self, message):
+        try:
+            self.send(message.chat_id, message.text, **message.kwargs)
+            self.sent += 1
+            return
+        except Exception as e:
+            error = e
+        retry_after = telegram_retry_after(error)
+        if retry_after is not None:
+            logger.warning(f"Telegram rate limit for chat {message.chat_id}, retrying in {retry_after} seconds.")
+            self._requeue(message, retry_after)
+            return
+        message.attempts += 1
+        if is_permanent_error(error) or message.attempts >= self.max_attempts:
+            self.failed += 1
+            logger.error(f"Failed to send message to chat {message.chat_id}: {str(error)}")
+            return
+        delay = self.backoff * 2 ** (message.attempts - 1)
+        logger.warning(f"Failed to send message to chat {message.chat_id} ({str(error)}), retrying in {delay} seconds.")
+        self._requeue(message, delay)
@@ -0,0 +1,150 @@
+"""
+It contains the shared Google Sheets client manager.
+"""
+
+import datetime
+import logging
+import threading
+from functools import wraps
+
+import gspread
+import requests
+from google.auth.exceptions import RefreshError, TransportError
+from google.auth.transport.requests import Request
+from requests.adapters import HTTPAdapter
+
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+POOL_SIZE = 10  # keep-alive connections per host
+TOKEN_REFRESH_MARGIN = datetime.timedelta(minutes=5)
+# Errors after which the session is dropped and re-created on the next call
+RECONNECT_ERRORS = (RefreshError, TransportError, requests.exceptions.ConnectionError)
+
+request_latency = Histogram("sheets_request_seconds", "Google Sheets API call latency", ["operation"])
+request_failures = Counter("sheets_request_failures_total", "Failed Google Sheets API calls", ["operation"])
+
+
+class GoogleSheetsClient:
+    """One authenticated gspread session shared by every worksheet of the bot.
+
+    The session keeps a pool of keep-alive HTTPS connections, the access token is refreshed
+    TOKEN_REFRESH_MARGIN before it expires, and opened spreadsheets and worksheets are cached.
+    Nothing is connected until the first request; after a connection or auth failure the
+    session is re-created on the next request instead of staying broken.
+    """
+
+    def __init__(self, credentials_file, pool_size=POOL_SIZE):
+        self.credentials_file = credentials_file
+        self.pool_size = pool_size
+        self._client = None
+        self._auth_session = None
+        self._spreadsheets = {}
+        self._worksheets = {}
+        self._lock = threading.RLock()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                self._connect()
+            self._refresh_token_if_needed()
+            return self._client
+
+    def spreadsheet(self, spreadsheet_id):
+        with self._lock:
+            client = self.client()
+            spreadsheet = self._spreadsheets.get(spreadsheet_id)
+            if spreadsheet is None:
+                spreadsheet = client.open_by_key(spreadsheet_id)
+                self._spreadsheets[spreadsheet_id] = spreadsheet
+            return spreadsheet
+
+    def worksheet(self, spreadsheet_id, sheet_name):
+        with self._lock:
+            spreadsheet = self.spreadsheet(spreadsheet_id)
+            worksheet = self._worksheets.get((spreadsheet_id, sheet_name))
+            if worksheet is None:
+                worksheet = spreadsheet.worksheet(sheet_name)
+                self._worksheets[(spreadsheet_id, sheet_name)] = worksheet
+            return worksheet
+
+    def worksheet_handle(self, spreadsheet_id, sheet_name):
+        """
+        Returns a WorksheetHandle that is resolved (and reconnected if needed) on every use.
+        """
+        return WorksheetHandle(self, spreadsheet_id, sheet_name)
+
+    def reset(self):
+        """
+        Drops the session and all cached handles, the next call connects again.
+        """
+        with self._lock:
+            if self._client is not None:
+                self._client.session.close()
+            self._client = None
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+
+    def _connect(self):
+        client = gspread.service_account(filename=self.credentials_file)
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        client.session.mount("https://", adapter)
+        if self._auth_session is None:
+            self._auth_session = requests.Session()
+            self._auth_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=1))
+        self._client = client
+        logger.info("Connected to Google Sheets.")
+
+    def _refresh_token_if_needed(self):
+        credentials = self._client.auth
+        # google-auth keeps expiry as a naive UTC datetime
+        expires_in = None
+        if credentials.token is not None and credentials.expiry is not None:
+            expires_in = credentials.expiry - datetime.datetime.utcnow()
+        if expires_in is None or expires_in < TOKEN_REFRESH_MARGIN:
+            credentials.refresh(Request(self._auth_session))
+            logger.info("Google API access token has been refreshed.")
+
+
+class WorksheetHandle:
+    """
+    Stands in for gspread.Worksheet. Every attribute is looked up on the worksheet cached
+    by GoogleSheetsClient, and connection or auth errors reset the client before they are raised.
+    Calls are timed in the sheets_request_seconds histogram.
+    """
+
+    def __init__(self, sheets_client, spreadsheet_id, sheet_name):
+        self._sheets_client = sheets_client
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+
+    def _resolve(self):
+        try:
+            return self._sheets_client.worksheet(self.spreadsheet_id, self.sheet_name)
+        except RECONNECT_ERRORS:
+            self._sheets_client.reset()
+            raise
+
+    def __getattr__(self, name):
+        attribute = getattr(self._resolve(), name)
+        if not callable(attribute):
+            return attribute
+
+        @wraps(attribute)
+        def call(*args, **kwargs):
+            try:
+                with request_latency.time(operation=name):
+                    return attribute(*args, **kwargs)
+            except RECONNECT_ERRORS as e:
+                request_failures.inc(operation=name)
+                logger.warning(f"Google Sheets connection failed, reconnecting on the next call: {str(e)}")
+                self._sheets_client.reset()
+                raise
+            except Exception:
+                request_failures.inc(operation=name)
+                raise
+        return call
+
+    def __repr__(self):
+        return f"WorksheetHandle(spreadsheet_id={self.spreadsheet_id!r}, sheet_name={self.sheet_name!r})"
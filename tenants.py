@@ -0,0 +1,90 @@
+"""
+It contains the registry of chats (tenants) served by the bot.
+Every tenant has its own events worksheet, event cache and reminder queue.
+"""
+
+import json
+import logging
+
+from reminder_scheduler import parse_offsets
+from weather_check import DEFAULT_LOCATION, Location
+
+logger = logging.getLogger(__name__)
+
+
+class Tenant:
+    """
+    One Telegram chat and the spreadsheet it keeps its schedule in
+    """
+    def __init__(self, chat_id, spreadsheet_id, sheet_name, birthday_sheet_name="Birthdays", locations=None,
+                 reminders=None):
+        self.chat_id = int(chat_id)
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.birthday_sheet_name = birthday_sheet_name
+        # Weather locations of the chat, used by /w without arguments and the daily forecast
+        if locations:
+            self.locations = [Location(**location) for location in locations]
+        else:
+            self.locations = [DEFAULT_LOCATION]
+        # Reminder offsets of the chat like "24h,4h,1h", None - REMINDER_OFFSETS of the deployment
+        self.reminder_offsets = parse_offsets(reminders) if reminders else None
+        # Filled in when the tenant is connected to its spreadsheet
+        self.event_store = None
+        self.birthday_index = None
+        self.reminder_scheduler = None
+        self.retry_at = 0  # time.monotonic() before which sync_tenant skips the tenant after a failed sync
+
+    def __repr__(self):
+        return f"Tenant(chat_id={self.chat_id}, spreadsheet_id={self.spreadsheet_id!r}, sheet_name={self.sheet_name!r})"
+
+
+class TenantRegistry:
+    """
+    Maps chat ids to tenants and splits them between notifier workers
+    """
+    def __init__(self, tenants=()):
+        self._tenants = {}
+        for tenant in tenants:
+            self.add(tenant)
+
+    @classmethod
+    def from_config(cls, path):
+        """
+        Loads tenants from a JSON file with a list of objects:
+        [{"chat_id": -100123, "spreadsheet_id": "...", "sheet_name": "Schedule", "birthday_sheet_name": "Birthdays",
+          "locations": [{"name": "Novi-Sad", "latitude": 45.25, "longitude": 19.83}], "reminders": "24h,4h,1h"}]
+        """
+        with open(path) as config_file:
+            config = json.load(config_file)
+        registry = cls(Tenant(**entry) for entry in config)
+        logger.info(f"Loaded {len(registry)} tenants from {path}.")
+        return registry
+
+    def add(self, tenant):
+        if tenant.chat_id in self._tenants:
+            raise ValueError(f"Chat {tenant.chat_id} is configured twice")
+        self._tenants[tenant.chat_id] = tenant
+
+    def get(self, chat_id):
+        return self._tenants.get(chat_id)
+
+    def __iter__(self):
+        return iter(list(self._tenants.values()))
+
+    def __len__(self):
+        return len(self._tenants)
+
+    def __contains__(self, chat_id):
+        return chat_id in self._tenants
+
+
+def shard_index(chat_id, shard_count):
+    """
+    Returns the notifier worker that serves chat_id
+    """
+    return chat_id % shard_count
+
+
+def shard(tenants, index, shard_count):
+    return [tenant for tenant in tenants if shard_index(tenant.chat_id, shard_count) == index]
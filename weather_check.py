@@ -1,5 +1,15 @@
-import requests
+import datetime
 import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import CallbackCounter, Counter, Histogram
 
 # Enable logging
 logging.basicConfig(
@@ -50,24 +60,195 @@ wind_ranges = [
         (118, float('inf'), "Hurricane-force", "Devastation")
     ]
 
-def request_weather_api(latitude=45.25, longitude=19.83):
+REQUEST_TIMEOUT = (3.05, 10)  # connect and read timeouts in seconds
+# Forecasts older than their hour are still served for this long while a fresh one is fetched in the background
+STALE_WHILE_REVALIDATE = 15 * 60
+# Open-Meteo accepts comma separated coordinates, this many locations are requested at once
+BATCH_SIZE = 50
+BATCH_WORKERS = 4
+
+METEO_URL = 'https://api.open-meteo.com/v1/forecast'
+GEOCODING_URL = 'https://geocoding-api.open-meteo.com/v1/search'
+
+Location = namedtuple("Location", ["name", "latitude", "longitude"])
+DEFAULT_LOCATION = Location("Novi-Sad", 45.25, 19.83)
+
+request_latency = Histogram("open_meteo_request_seconds", "Open-Meteo API call latency", ["endpoint"])
+request_failures = Counter("open_meteo_request_failures_total", "Failed Open-Meteo API calls", ["endpoint"])
+
+# Keep-alive connections to open-meteo.com are reused by every request
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=BATCH_WORKERS))
+
+def request_weather_batch(coordinates):
     """
-    Request open-meteo API endpoint with Novi-Sad location by default. Return json response.
+    Request open-meteo API endpoint for a list of (latitude, longitude) pairs with one HTTP call.
+    Return list of json responses in the same order, or None if the request failed.
     """
-    meteo_url = f'https://api.open-meteo.com/v1/forecast?latitude={latitude}&longitude={longitude}&current=temperature_2m,rain,showers,snowfall,weather_code,wind_speed_10m&hourly=temperature_2m,rain,showers,snowfall,weather_code,wind_speed_10m&daily=uv_index_max,uv_index_clear_sky_max,precipitation_sum,rain_sum,showers_sum,snowfall_sum,precipitation_probability_max,wind_speed_10m_max&timezone=Europe%2FBerlin&forecast_days=1'
-    response = requests.get(meteo_url)
+    params = {
+        'latitude': ','.join(str(latitude) for latitude, _ in coordinates),
+        'longitude': ','.join(str(longitude) for _, longitude in coordinates),
+        'current': 'temperature_2m,rain,showers,snowfall,weather_code,wind_speed_10m',
+        'hourly': 'temperature_2m,rain,showers,snowfall,weather_code,wind_speed_10m',
+        'daily': 'uv_index_max,uv_index_clear_sky_max,precipitation_sum,rain_sum,showers_sum,snowfall_sum,precipitation_probability_max,wind_speed_10m_max',
+        'timezone': 'auto',
+        'forecast_days': 1,
+    }
     try:
+        with request_latency.time(endpoint="forecast"):
+            response = session.get(METEO_URL, params=params, timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
-            return response.json()
+            data = response.json()
+            # A single location is returned as an object, several ones as a list
+            return data if isinstance(data, list) else [data]
         else:
+            request_failures.inc(endpoint="forecast")
             logger.error(f"Error occurred during API request: HTTP {response.status_code}")
             return None
     except Exception as e:
+        request_failures.inc(endpoint="forecast")
         logger.error(f"Error occurred during API request: {e}")
         return None
 
-def weather_one_time_forecast():
-    response = request_weather_api()
+def request_weather_many(coordinates, batch_size=BATCH_SIZE):
+    """
+    Request forecasts for many (latitude, longitude) pairs in batches of batch_size, batches are fetched concurrently.
+    Return list of json responses in the same order, None for the locations of failed batches.
+    """
+    batches = [coordinates[start:start + batch_size] for start in range(0, len(coordinates), batch_size)]
+    if len(batches) == 1:
+        responses = [request_weather_batch(batches[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+            responses = list(executor.map(request_weather_batch, batches))
+    forecasts = []
+    for batch, response in zip(batches, responses):
+        forecasts.extend(response if response is not None else [None] * len(batch))
+    return forecasts
+
+# Cities looked up by /w, including the ones that were not found
+GEOCODING_CACHE_SIZE = 256
+
+@lru_cache(maxsize=GEOCODING_CACHE_SIZE)
+def geocode(name):
+    """
+    Requests the Open-Meteo geocoding API. Returns Location or None if nothing was found.
+    Failed requests raise, so they are not cached.
+    """
+    with request_latency.time(endpoint="geocoding"):
+        response = session.get(GEOCODING_URL, params={'name': name, 'count': 1}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    results = response.json().get('results')
+    return Location(results[0]['name'], results[0]['latitude'], results[0]['longitude']) if results else None
+
+def find_location(name):
+    """
+    Looks up a city with the Open-Meteo geocoding API. Returns Location or None if nothing was found.
+    """
+    try:
+        return geocode(name.strip().lower())
+    except Exception as e:
+        request_failures.inc(endpoint="geocoding")
+        logger.error(f"Error occurred during geocoding request: {e}")
+        return None
+
+def seconds_until_next_hour(current_datetime=None):
+    """
+    Open-Meteo hourly data changes once an hour, so a forecast expires at the start of the next hour
+    """
+    if current_datetime is None:
+        current_datetime = datetime.datetime.now()
+    next_hour = current_datetime.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)
+    return (next_hour - current_datetime).total_seconds()
+
+class ForecastCache:
+    """
+    Caches Open-Meteo responses by (latitude, longitude) until the start of the next hour.
+    An expired forecast younger than STALE_WHILE_REVALIDATE is returned as is and refreshed
+    in a background thread; older ones (or missing ones) are fetched before returning.
+    All locations missing from one get_many() call are fetched with batched requests.
+    """
+    def __init__(self, fetch_many=request_weather_many, stale_while_revalidate=STALE_WHILE_REVALIDATE):
+        self.fetch_many = fetch_many
+        self.stale_while_revalidate = stale_while_revalidate
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}  # (latitude, longitude) -> (forecast, expires_at as time.monotonic(), date of the forecast)
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def get(self, latitude, longitude):
+        return self.get_many([(latitude, longitude)])[0]
+
+    def get_many(self, coordinates):
+        """
+        Returns forecasts for the list of (latitude, longitude) pairs, None for unavailable ones
+        """
+        now = time.monotonic()
+        today = datetime.date.today()
+        forecasts = {}
+        outdated = {}
+        missing = []
+        revalidate = []
+        with self._lock:
+            for key in dict.fromkeys(coordinates):
+                entry = self._entries.get(key)
+                # Forecasts are for one day, yesterday's one is never served
+                usable = entry is not None and entry[2] == today
+                if usable and now < entry[1]:
+                    self.hits += 1
+                    forecasts[key] = entry[0]
+                elif usable and now < entry[1] + self.stale_while_revalidate:
+                    self.hits += 1
+                    forecasts[key] = entry[0]
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        revalidate.append(key)
+                else:
+                    self.misses += 1
+                    missing.append(key)
+                    if usable:
+                        outdated[key] = entry[0]
+        if revalidate:
+            threading.Thread(target=self._refresh, args=(revalidate,), name="Weather refresh thread", daemon=True).start()
+        if missing:
+            for key, forecast in zip(missing, self._refresh(missing)):
+                if forecast is None and key in outdated:
+                    logger.warning("Open-Meteo is not available, returning an outdated forecast.")
+                    forecast = outdated[key]
+                forecasts[key] = forecast
+        return [forecasts[key] for key in coordinates]
+
+    def _refresh(self, keys):
+        try:
+            fetched = self.fetch_many(keys)
+            expires_at = time.monotonic() + seconds_until_next_hour()
+            with self._lock:
+                for key, forecast in zip(keys, fetched):
+                    if forecast is not None:
+                        self._entries[key] = (forecast, expires_at, datetime.date.today())
+            return fetched
+        finally:
+            with self._lock:
+                self._refreshing.difference_update(keys)
+
+forecast_cache = ForecastCache()
+CallbackCounter("forecast_cache_requests_total", "Forecast cache lookups by result", ["result"],
+                function=lambda: {("hit",): forecast_cache.hits, ("miss",): forecast_cache.misses})
+
+def weather_forecasts(locations):
+    """
+    Returns forecast texts for the list of locations, fetched from cache or with batched requests
+    """
+    responses = forecast_cache.get_many([(location.latitude, location.longitude) for location in locations])
+    return [f"Weather forecast for {location.name}:\n" + format_forecast(response) for location, response in zip(locations, responses)]
+
+def weather_one_time_forecast(latitude=DEFAULT_LOCATION.latitude, longitude=DEFAULT_LOCATION.longitude):
+    return format_forecast(forecast_cache.get(latitude, longitude))
+
+def format_forecast(response):
+    if response is None:
+        return "Weather forecast is not available right now, please try again later."
     temperatures = response["hourly"]["temperature_2m"]
     hourly_codes = response["hourly"]["weather_code"]
     wind_speed_max = response["daily"]["wind_speed_10m_max"][0]
@@ -0,0 +1,83 @@
+"""
+It contains the webhook mode: Telegram updates POSTed to the Flask app are handled by a bounded worker pool.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import request
+from telebot.types import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/telegram-webhook"
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class UpdateDispatcher:
+    """Passes webhook updates to process(update) in a pool of worker threads.
+
+    At most workers updates are processed and queue_size more are waiting at any time.
+    submit() does not block: when the pool is full it returns False, the webhook answers
+    503 and Telegram delivers the update again later, so a burst can not pile up in memory.
+    """
+
+    def __init__(self, process, workers=4, queue_size=100):
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self.accepted = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="Webhook worker")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def submit(self, update):
+        """
+        Queues the update. Returns False if the pool is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            return False
+        with self._lock:
+            self.accepted += 1
+            self._in_flight += 1
+        self._executor.submit(self._run, update)
+        return True
+
+    def in_flight(self):
+        """
+        Returns the number of updates that are being processed or waiting for a worker
+        """
+        with self._lock:
+            return self._in_flight
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, update):
+        try:
+            self.process(update)
+        except Exception as e:
+            logger.error(f"An error occurred while processing update {update.update_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._slots.release()
+
+
+def handle_webhook_request(dispatcher, secret_token=None):
+    """
+    Body of the Flask webhook view. Returns (response body, HTTP status).
+    """
+    if secret_token and request.headers.get(SECRET_TOKEN_HEADER) != secret_token:
+        return "", 403
+    update = Update.de_json(request.get_data(as_text=True))
+    if update is None:
+        return "", 400
+    if not dispatcher.submit(update):
+        return "", 503
+    return "", 200